@@ -0,0 +1,147 @@
+import os
+import datetime
+from app.db import DB
+from app.versions import versions
+
+AVAILABILITY_RECONCILE_SECONDS = int(os.getenv("AVAILABILITY_RECONCILE_SECONDS", "60"))
+
+SCHEDULE_QUERY = """
+    SELECT [ScheduleId], [SpaceId], [Day], [StartHour], [EndHour], [Occupied]
+    FROM [dbo].[Schedule]
+    WHERE [Day] >= CAST(GETDATE() AS Date);
+"""
+
+
+class AvailabilityIndex:
+    """
+    In-memory copy of the upcoming rows of dbo.Schedule.
+
+    Each (SpaceId, Day) has an integer bitmap where bit `h` is set when the slot starting at
+    hour `h` is free, plus the ScheduleId, StartHour and EndHour of every slot so the read
+    endpoints can answer without touching the database.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.loaded_at = None
+        self.last_drift = 0
+        self._free = {}
+        self._slots = {}
+        self._by_schedule = {}
+        self._marked_during_reload = None
+
+    def _add(self, schedule_id, space_id, day, start_hour, end_hour, occupied):
+        key = (space_id, day)
+        hour = start_hour.hour
+        self._slots.setdefault(key, {})[hour] = (schedule_id, start_hour, end_hour)
+        self._by_schedule[schedule_id] = (key, hour)
+        if occupied:
+            self._free[key] = self._free.get(key, 0) & ~(1 << hour)
+        else:
+            self._free[key] = self._free.get(key, 0) | (1 << hour)
+
+    def snapshot(self):
+        return {schedule_id: not self._free.get(key, 0) >> hour & 1 for schedule_id, (key, hour) in self._by_schedule.items()}
+
+    def begin_reload(self):
+        self._marked_during_reload = set()
+
+    def abort_reload(self):
+        self._marked_during_reload = None
+
+    def finish_reload(self, rows):
+        """
+        Replaces the index with `rows` and returns how many slots disagreed with the previous state.
+        Slots marked occupied while the rows were being read are re-applied so they are not lost.
+        """
+        previous = self.snapshot() if self.ready else {}
+        marked = self._marked_during_reload or set()
+        self._free, self._slots, self._by_schedule = {}, {}, {}
+        for row in rows:
+            self._add(row[0], row[1], row[2], row[3], row[4], row[5])
+        self._marked_during_reload = None
+        for schedule_id in marked:
+            self.mark_occupied(schedule_id)
+
+        current = self.snapshot()
+        drift = sum(1 for schedule_id, occupied in current.items() if schedule_id in previous and previous[schedule_id] != occupied)
+        self.ready = True
+        self.loaded_at = datetime.datetime.now()
+        self.last_drift = drift
+        return drift
+
+    def mark_occupied(self, schedule_id):
+        if self._marked_during_reload is not None:
+            self._marked_during_reload.add(schedule_id)
+        entry = self._by_schedule.get(schedule_id)
+        if entry is None:
+            return
+        key, hour = entry
+        self._free[key] = self._free.get(key, 0) & ~(1 << hour)
+
+    def free_slots(self, space_id, day, from_hour=0):
+        """
+        Free (ScheduleId, StartHour, EndHour) tuples of a space on a day, ordered by hour.
+        """
+        key = (space_id, day)
+        bitmap = self._free.get(key, 0) >> from_hour << from_hour
+        slots = self._slots.get(key, {})
+        result = []
+        while bitmap:
+            lowest = bitmap & -bitmap
+            result.append(slots[lowest.bit_length() - 1])
+            bitmap ^= lowest
+        return result
+
+    def free_slot(self, space_id, day, hour):
+        """
+        (ScheduleId, StartHour, EndHour) of the free slot of a space starting at `hour`, or None.
+        """
+        key = (space_id, day)
+        if self._free.get(key, 0) >> hour & 1:
+            return self._slots[key][hour]
+        return None
+
+    def find_free_schedule(self, space_id, day, start_hour):
+        """
+        ScheduleId of a free slot from the 'YYYY-MM-DD' and 'HH:MM[:SS]' strings the endpoints receive, or None.
+        """
+        slot = self.free_slot(space_id, datetime.date.fromisoformat(day), datetime.time.fromisoformat(start_hour).hour)
+        return slot[0] if slot else None
+
+    def days(self, space_id, from_day):
+        return sorted(day for (space, day) in self._slots if space == space_id and day >= from_day)
+
+    def hour_status(self, day, hour):
+        """
+        (SpaceId, occupied) for every space that has a slot starting at `hour` on `day`.
+        """
+        result = []
+        for (space_id, slot_day), slots in self._slots.items():
+            if slot_day == day and hour in slots:
+                result.append((space_id, not self._free.get((space_id, day), 0) >> hour & 1))
+        return sorted(result)
+
+
+availability = AvailabilityIndex()
+
+
+async def refresh_availability():
+    """
+    Reloads the index from dbo.Schedule and reports how many slots had drifted from the database.
+    """
+    availability.begin_reload()
+    try:
+        async with DB() as db:
+            rows = await db.execute_query(SCHEDULE_QUERY)
+    except Exception:
+        availability.abort_reload()
+        raise
+    if rows is None:
+        availability.abort_reload()
+        return None
+    drift = availability.finish_reload(rows)
+    if drift:
+        versions.bump_all()
+        print(f"Availability index drifted from the database on {drift} slots")
+    return drift
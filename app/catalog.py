@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+from app.db import DB
+from app.models import Zone, Space, SpaceRequirement
+
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "3600"))
+
+
+class CatalogCache:
+    """
+    Read-through cache of the Space, Zone and space requirement catalog.
+
+    The whole Space and Zone tables are loaded together (with a zone -> spaces index) the first
+    time anything is asked for and again once `ttl` seconds have passed; requirements are loaded
+    per space on demand. `invalidate()` drops everything so the next read goes to the database.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else CATALOG_TTL_SECONDS
+        self._lock = asyncio.Lock()
+        self._loaded_at = None
+        self._zones = {}
+        self._zones_by_name = {}
+        self._spaces = {}
+        self._spaces_by_name = {}
+        self._spaces_by_zone = {}
+        self._requirements = {}
+
+    def _expired(self, loaded_at):
+        return loaded_at is None or time.monotonic() - loaded_at > self.ttl
+
+    def invalidate(self):
+        self._loaded_at = None
+        self._requirements = {}
+
+    async def _load(self):
+        async with DB(read_only=True) as db:
+            zone_rows = await db.execute_query("SELECT [ZoneId], [ZoneName], [Description], [Goal] FROM [dbo].[Zone];")
+            space_rows = await db.execute_query("SELECT [SpaceId], [Name], [Description], [ZoneId] FROM [dbo].[Space];")
+        if zone_rows is None or space_rows is None:
+            raise Exception("Could not load the space catalog")
+
+        zones = {row[0]: Zone(zone_id=row[0], zone_name=row[1], description=row[2], goal=row[3] or 0) for row in zone_rows}
+        spaces = {row[0]: Space(space_id=row[0], name=row[1], description=row[2], zone_id=row[3]) for row in space_rows}
+        spaces_by_zone = {}
+        for space in spaces.values():
+            spaces_by_zone.setdefault(space.zone_id, []).append(space)
+
+        self._zones = zones
+        # Unnamed rows are still listed, they just cannot be looked up by name
+        self._zones_by_name = {zone.zone_name.lower(): zone for zone in zones.values() if zone.zone_name is not None}
+        self._spaces = spaces
+        self._spaces_by_name = {space.name.lower(): space for space in spaces.values() if space.name is not None}
+        self._spaces_by_zone = spaces_by_zone
+        self._loaded_at = time.monotonic()
+
+    async def _ensure_loaded(self):
+        if not self._expired(self._loaded_at):
+            return
+        async with self._lock:
+            if self._expired(self._loaded_at):
+                await self._load()
+
+    async def zones(self):
+        await self._ensure_loaded()
+        return list(self._zones.values())
+
+    async def zone(self, zone_id):
+        await self._ensure_loaded()
+        return self._zones.get(zone_id)
+
+    async def zone_by_name(self, zone_name):
+        await self._ensure_loaded()
+        return self._zones_by_name.get(zone_name.lower())
+
+    async def spaces(self):
+        await self._ensure_loaded()
+        return list(self._spaces.values())
+
+    async def space(self, space_id):
+        await self._ensure_loaded()
+        return self._spaces.get(space_id)
+
+    async def space_by_name(self, space_name):
+        await self._ensure_loaded()
+        return self._spaces_by_name.get(space_name.lower())
+
+    async def spaces_in_zone(self, zone_id):
+        await self._ensure_loaded()
+        return list(self._spaces_by_zone.get(zone_id, []))
+
+    async def requirements(self, space_id):
+        loaded_at, requirements = self._requirements.get(space_id, (None, None))
+        if not self._expired(loaded_at):
+            return requirements
+        async with DB(read_only=True) as db:
+            rows = await db.execute_query("EXEC GetSpaceRequirements @SpaceId = ?", (space_id,))
+        if rows is None:
+            raise Exception("Could not load the space requirements")
+        requirements = [
+            SpaceRequirement(space_id=row[0], requirement_id=row[1], requirement_name=row[2], max_quantity=row[3])
+            for row in rows
+        ]
+        self._requirements[space_id] = (time.monotonic(), requirements)
+        return requirements
+
+
+catalog = CatalogCache()
@@ -1,55 +1,432 @@
 import os
+import time
+import asyncio
+import importlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pyodbc
 from dotenv import load_dotenv
+from app.metrics import db_query_duration, db_query_errors, db_connections_opened, db_connections_closed
+from app.query_log import TimedCursor
+from app.versions import versions
 
 load_dotenv()
 
+
+class DBOverloadedError(Exception):
+    pass
+
+
+class DBExecutor:
+    """
+    Runs blocking pyodbc calls on a dedicated thread pool so the event loop never waits on the driver.
+
+    At most `max_concurrency` calls run at once; once `max_queue` callers are already waiting
+    for a slot, new calls fail fast with `DBOverloadedError` instead of piling up.
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=None):
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(os.getenv("DB_EXECUTOR_WORKERS", "10"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("DB_EXECUTOR_MAX_QUEUE", "100"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="db")
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._waiting = 0
+        self._calls = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    async def run(self, fn, *args, backpressure=True):
+        if backpressure and self._slots.locked() and self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise DBOverloadedError(f"Database executor queue is full ({self._waiting} waiting)")
+        queued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        started_at = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        # The slot is freed when the thread is done with the call, not when the caller gives up on it
+        future.add_done_callback(lambda _: self._finished(queued_at, started_at))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # A running pyodbc call cannot be interrupted; wait it out so the caller does not touch
+            # the same connection (rollback, cursor.close) from another thread while it runs
+            await asyncio.wait({future})
+            raise
+
+    def _finished(self, queued_at, started_at):
+        self._slots.release()
+        self._record(started_at - queued_at, time.perf_counter() - started_at)
+
+    def _record(self, waited, ran):
+        self._calls += 1
+        self._wait_total += waited
+        self._run_total += ran
+        self._wait_max = max(self._wait_max, waited)
+        self._run_max = max(self._run_max, ran)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "waiting": self._waiting,
+            "calls": self._calls,
+            "rejected": self._rejected,
+            "wait_seconds_total": self._wait_total,
+            "wait_seconds_max": self._wait_max,
+            "run_seconds_total": self._run_total,
+            "run_seconds_max": self._run_max,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+executor = DBExecutor()
+
+
+def load_connection_factory(path):
+    """
+    Resolves a 'module:callable' path, e.g. DB_CONNECTION_FACTORY=benchmarks.fake_db:connect.
+    """
+    if not path:
+        return None
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of pyodbc connections shared by every `DB` context.
+
+    Connections are validated on checkout when they have been idle for longer
+    than `validate_after` seconds, and idle connections above `min_size` are
+    closed once they have been unused for `idle_timeout` seconds. A checkout that waits longer
+    than `acquire_timeout` seconds for a free connection fails with `DBOverloadedError`.
+
+    Connections are opened with `connection_factory(connection_string)`, which defaults to
+    `pyodbc.connect`; the benchmarks swap in an in-process fake database through it.
+    """
+
+    def __init__(self, connection_string=None, min_size=None, max_size=None, idle_timeout=None, validate_after=None, acquire_timeout=None, connection_factory=None):
+        self.connection_string = connection_string
+        self.connection_factory = connection_factory
+        self.min_size = min_size if min_size is not None else int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+        self.max_size = max_size if max_size is not None else int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+        self.validate_after = validate_after if validate_after is not None else float(os.getenv("DB_POOL_VALIDATE_AFTER", "30"))
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30"))
+        self._idle = deque()
+        self._size = 0
+        self._timeouts = 0
+        self._slots = asyncio.Semaphore(self.max_size)
+
+    def connect(self):
+        connection_string = self.connection_string or os.getenv("AZURE_SQL_CONNECTIONSTRING")
+        connection = (self.connection_factory or pyodbc.connect)(connection_string)
+        db_connections_opened.inc()
+        return connection
+
+    def _close(self, connection):
+        db_connections_closed.inc()
+        try:
+            connection.close()
+        except pyodbc.Error:
+            pass
+
+    async def _discard(self, connection):
+        self._size -= 1
+        await executor.run(self._close, connection, backpressure=False)
+
+    def _is_healthy(self, connection):
+        try:
+            if connection.closed:
+                return False
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except pyodbc.Error:
+            return False
+
+    async def _evict_idle(self):
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.popleft()
+            await self._discard(connection)
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise DBOverloadedError(f"No database connection became free within {self.acquire_timeout}s")
+        try:
+            await self._evict_idle()
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.validate_after or await executor.run(self._is_healthy, connection, backpressure=False):
+                    return connection
+                await self._discard(connection)
+            connection = await executor.run(self.connect, backpressure=False)
+            self._size += 1
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _reset(self, connection):
+        try:
+            if connection.closed:
+                return False
+            connection.rollback()
+            return True
+        except pyodbc.Error:
+            return False
+
+    async def release(self, connection, discard=False):
+        try:
+            if not discard:
+                discard = not await executor.run(self._reset, connection, backpressure=False)
+            if discard:
+                await self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+        finally:
+            self._slots.release()
+        await self._evict_idle()
+
+    async def warm_up(self):
+        while self._size < self.min_size:
+            self._idle.append((await executor.run(self.connect, backpressure=False), time.monotonic()))
+            self._size += 1
+
+    async def close(self):
+        while self._idle:
+            connection, _ = self._idle.popleft()
+            await self._discard(connection)
+
+    def stats(self):
+        return {"size": self._size, "idle": len(self._idle), "min_size": self.min_size, "max_size": self.max_size, "acquire_timeouts": self._timeouts}
+
+
+pool = ConnectionPool(connection_factory=load_connection_factory(os.getenv("DB_CONNECTION_FACTORY")))
+
+
+class ReplicaRouter:
+    """
+    Decides whether a read-only `DB` context may use the read replica.
+
+    Reads stay on the primary when no replica is configured, for DB_REPLICA_STALENESS_SECONDS
+    after the user (or everything, e.g. the schedule job) was written in this process or the
+    client wrote through any worker (its write pin, see VersionCounters), and for
+    DB_REPLICA_RETRY_SECONDS after the replica failed.
+    """
+
+    def __init__(self, replica_pool=None, staleness=None, retry_after=None):
+        self.pool = replica_pool
+        self.staleness = staleness if staleness is not None else float(os.getenv("DB_REPLICA_STALENESS_SECONDS", "5"))
+        self.retry_after = retry_after if retry_after is not None else float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+        self._failed_at = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.fallbacks = 0
+        self.busy_fallbacks = 0
+
+    def pool_for(self, read_only, user_id=None):
+        if not read_only:
+            return pool
+        if self.pool is None or versions.written_within(self.staleness, user_id) or (self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_after):
+            self.primary_reads += 1
+            return pool
+        self.replica_reads += 1
+        return self.pool
+
+    def failed(self, error):
+        print(f"Read replica error, falling back to the primary: {error}")
+        self._failed_at = time.monotonic()
+        self.fallbacks += 1
+
+    def busy(self):
+        self.busy_fallbacks += 1
+
+    def stats(self):
+        return {"replica_reads": self.replica_reads, "primary_reads": self.primary_reads, "fallbacks": self.fallbacks, "busy_fallbacks": self.busy_fallbacks}
+
+
+replica_pool = ConnectionPool(
+    connection_string=os.getenv("AZURE_SQL_READ_CONNECTIONSTRING"),
+    connection_factory=pool.connection_factory,
+) if os.getenv("AZURE_SQL_READ_CONNECTIONSTRING") else None
+replicas = ReplicaRouter(replica_pool)
+
+
 class DB:
-    def __init__(self):
+    """
+    A connection checked out of the pool for the duration of an `async with` block.
+
+    `read_only=True` lets the reads go to the read replica (AZURE_SQL_READ_CONNECTIONSTRING);
+    pass the `user_id` whose data is read so their own recent writes are read from the primary.
+    """
+
+    def __init__(self, read_only=False, user_id=None):
+        self.read_only = read_only
+        self.user_id = user_id
+        self.pool = pool
         self.connection = None
+        self.broken = False
 
     async def __aenter__(self):
         if self.connection is None or await self.is_closed():
-            self.connection = self.connect()
+            self.pool = replicas.pool_for(self.read_only, self.user_id)
+            try:
+                self.connection = await self.pool.acquire()
+            except (pyodbc.Error, DBOverloadedError) as e:
+                if self.pool is pool:
+                    raise
+                # A busy replica pool is no reason to back off from the replica, only a failing one is
+                if isinstance(e, DBOverloadedError):
+                    replicas.busy()
+                else:
+                    replicas.failed(e)
+                self.pool = pool
+                self.connection = await pool.acquire()
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        if self.connection is not None and not await self.is_closed():
-            self.connection.close()
+        if self.connection is not None:
+            # A cancelled block may have left a driver call half done on this connection, never reuse it
+            discard = self.broken or isinstance(exc_value, (pyodbc.Error, asyncio.CancelledError))
+            await self.pool.release(self.connection, discard=discard)
+            self.connection = None
+            self.broken = False
 
-    def connect(self):
-        connection_string = os.getenv("AZURE_SQL_CONNECTIONSTRING")
-        return pyodbc.connect(connection_string)
+    async def _fall_back_to_primary(self, error):
+        replicas.failed(error)
+        connection, self.connection = self.connection, None
+        await self.pool.release(connection, discard=True)
+        self.pool = pool
+        self.broken = False
+        self.connection = await pool.acquire()
 
-    async def execute_query(self, query, params=None):
-        try:
-            cursor = self.connection.cursor()
+    def _fetch(self, query, params):
+        with db_query_duration.time("select"):
+            cursor = TimedCursor(self.connection.cursor())
             if params:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
-            return cursor.fetchall()
-        except pyodbc.Error as e:
-            print(f"Database error: {e}")
-            return None
-        
-    async def execute_query_insert(self, query, params=None):
-        try:
-            cursor = self.connection.cursor()
+            rows = cursor.fetchall()
+            cursor.flush()
+            return rows
+
+    def _execute_and_commit(self, query, params):
+        with db_query_duration.time("write"):
+            cursor = TimedCursor(self.connection.cursor())
             if params:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
+            cursor.flush()
             self.connection.commit()
             return cursor.rowcount
+
+    def _run_transaction(self, work):
+        cursor = TimedCursor(self.connection.cursor())
+        try:
+            with db_query_duration.time("transaction"):
+                result = work(cursor)
+                cursor.flush()
+                self.connection.commit()
+            return result
+        except Exception:
+            try:
+                self.connection.rollback()
+            except pyodbc.Error:
+                self.broken = True
+            raise
+
+    def _open_cursor(self, query, params):
+        with db_query_duration.time("stream"):
+            cursor = TimedCursor(self.connection.cursor())
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            return cursor
+
+    async def stream_query(self, query, params=None, batch_size=500):
+        """
+        Yield the result rows in `fetchmany` batches of `batch_size`.
+
+        The DB context has to stay open while iterating. Errors are raised instead of returning None.
+        """
+        try:
+            cursor = await executor.run(self._open_cursor, query, params)
+        except pyodbc.Error as e:
+            if self.pool is pool:
+                raise
+            await self._fall_back_to_primary(e)
+            cursor = await executor.run(self._open_cursor, query, params)
+        try:
+            while True:
+                rows = await executor.run(cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await executor.run(cursor.close, backpressure=False)
+
+    async def execute_query(self, query, params=None):
+        try:
+            return await executor.run(self._fetch, query, params)
+        except pyodbc.Error as e:
+            if self.pool is not pool:
+                await self._fall_back_to_primary(e)
+                return await self.execute_query(query, params)
+            db_query_errors.inc("select")
+            print(f"Database error: {e}")
+            self.mark_if_broken(e)
+            return None
+
+    async def execute_query_insert(self, query, params=None):
+        try:
+            return await executor.run(self._execute_and_commit, query, params)
         except pyodbc.Error as e:
+            db_query_errors.inc("write")
             print(f"Database error: {e}")
+            self.mark_if_broken(e)
             return None
-    
+
+    async def run_transaction(self, work):
+        """
+        Run `work(cursor)` on the DB executor and commit everything it did as one transaction.
+
+        Unlike the execute_* helpers, errors are rolled back and re-raised so batch jobs can retry.
+        """
+        try:
+            return await executor.run(self._run_transaction, work)
+        except pyodbc.Error as e:
+            db_query_errors.inc("transaction")
+            print(f"Database error: {e}")
+            self.mark_if_broken(e)
+            raise
+
+    def mark_if_broken(self, error):
+        # SQLSTATE class 08 means the connection itself failed, so it must not go back to the pool
+        if error.args and str(error.args[0]).startswith("08"):
+            self.broken = True
+
     async def is_closed(self):
         if self.connection is None:
             return True
         try:
             return self.connection.closed
         except pyodbc.ProgrammingError:  # Handle case where connection is not open yet
-            return True
\ No newline at end of file
+            return True
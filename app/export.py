@@ -0,0 +1,111 @@
+import io
+import os
+import csv
+import asyncio
+import tempfile
+from app.db import DB
+from app.formatting import format_date, format_time
+
+try:
+    import xlsxwriter
+except ImportError:  # XLSX export is optional
+    xlsxwriter = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_COLUMNS = ['Day', 'StartHour', 'EndHour', 'SpaceName', 'SpaceId', 'GroupCode', 'Name', 'Matricula', 'UserId', 'Eliminado']
+
+RESERVATIONS_EXPORT_QUERY = '''
+    SELECT [User].[Name], [User].[UserName], [Schedule].[Day], [Schedule].[StartHour], [Schedule].[EndHour], [Space].[Name], [Space].[SpaceId], [User].[UserId], [ReservationGroup].[GroupCode], [Reservation].[Deleted]
+    FROM [dbo].[User]
+    INNER JOIN [dbo].[Reservation]
+        ON [dbo].[User].[UserId] = [dbo].[Reservation].[UserId]
+    INNER JOIN [dbo].[Schedule]
+        ON [dbo].[Reservation].[ScheduleId] = [dbo].[Schedule].[ScheduleId]
+    INNER JOIN [dbo].[Space]
+        ON [dbo].[Reservation].[SpaceId] = [dbo].[Space].[SpaceId]
+    INNER JOIN [dbo].[ReservationGroup]
+        ON [dbo].[Reservation].[GroupId] = [dbo].[ReservationGroup].[GroupId]
+    WHERE {filters}
+    ORDER BY [Schedule].[Day], [Schedule].[StartHour]
+'''
+
+
+def reservations_export_query(start=None, end=None, zone_id=None):
+    """
+    Export query and params for reservations between `start` and `end` (inclusive dates),
+    optionally limited to one zone. Without `start` the last 30 days are exported.
+    """
+    filters = []
+    params = []
+    if start is None:
+        filters.append("[dbo].[Schedule].[Day] >= DATEADD(day, -30, CAST(GETDATE() AS Date))")
+    else:
+        filters.append("[dbo].[Schedule].[Day] >= ?")
+        params.append(start)
+    if end is not None:
+        filters.append("[dbo].[Schedule].[Day] <= ?")
+        params.append(end)
+    if zone_id is not None:
+        filters.append("[dbo].[Space].[ZoneId] = ?")
+        params.append(zone_id)
+    return RESERVATIONS_EXPORT_QUERY.format(filters=" AND ".join(filters)), tuple(params)
+
+
+def export_row(row):
+    return [
+        format_date(row[2]),
+        format_time(row[3]),
+        format_time(row[4]),
+        row[5],
+        row[6],
+        row[8],
+        row[0],
+        row[1],
+        row[7],
+        row[9],
+    ]
+
+
+async def stream_csv(query, params):
+    """
+    Yields the export as CSV, one chunk per `fetchmany` batch, starting with the header.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the accents in names correctly
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    async with DB(read_only=True) as db:
+        async for rows in db.stream_query(query, params, EXPORT_BATCH_SIZE):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(export_row(row) for row in rows)
+            yield buffer.getvalue()
+
+
+async def stream_xlsx(query, params, chunk_size=64 * 1024):
+    """
+    Writes the export with XlsxWriter in constant-memory mode to a temporary file and then
+    yields the file in chunks. XLSX is a zip archive, so nothing can be sent before it is complete.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as file:
+        workbook = xlsxwriter.Workbook(file.name, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Reservaciones')
+        worksheet.write_row(0, 0, EXPORT_COLUMNS)
+        row_number = 1
+
+        async with DB(read_only=True) as db:
+            async for rows in db.stream_query(query, params, EXPORT_BATCH_SIZE):
+                for row in rows:
+                    worksheet.write_row(row_number, 0, export_row(row))
+                    row_number += 1
+        await asyncio.to_thread(workbook.close)
+
+        while True:
+            chunk = await asyncio.to_thread(file.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -0,0 +1,62 @@
+from functools import lru_cache
+from fastapi.responses import ORJSONResponse
+
+MONTHS_ES = {
+    1: 'Enero',
+    2: 'Febrero',
+    3: 'Marzo',
+    4: 'Abril',
+    5: 'Mayo',
+    6: 'Junio',
+    7: 'Julio',
+    8: 'Agosto',
+    9: 'Septiembre',
+    10: 'Octubre',
+    11: 'Noviembre',
+    12: 'Diciembre',
+}
+
+
+# Result sets repeat the same handful of days and hours over and over, so the formatted
+# strings are cached instead of calling strftime for every row.
+@lru_cache(maxsize=4096)
+def format_date(value):
+    return value.strftime('%Y-%m-%d')
+
+
+@lru_cache(maxsize=256)
+def format_time(value):
+    return value.strftime('%H:%M')
+
+
+@lru_cache(maxsize=4096)
+def format_date_es(value):
+    return f"{value.day} de {MONTHS_ES[value.month]} {value.year}"
+
+
+def _identity(value):
+    return value
+
+
+def row_mapper(*fields):
+    """
+    Builds a function that turns a result row into a dict.
+
+    Each field is `(key, index)` to copy `row[index]` or `(key, index, formatter)` to store
+    `formatter(row[index])`. Keys, indexes and formatters are resolved once here, not per row.
+    """
+    keys = tuple(field[0] for field in fields)
+    indexes = tuple(field[1] for field in fields)
+    formatters = tuple(field[2] if len(field) == 3 else _identity for field in fields)
+    return lambda row: dict(zip(keys, [formatter(row[index]) for formatter, index in zip(formatters, indexes)]))
+
+
+def json_response(content, response=None):
+    """
+    Serializes `content` with orjson directly, skipping FastAPI's jsonable_encoder pass.
+    Headers already set on the injected `response` (ETag, X-Next-Cursor...) are kept.
+    """
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return ORJSONResponse(content, headers=headers)
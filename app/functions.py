@@ -1,8 +1,12 @@
 from app.db import DB
+from app.availability import availability, refresh_availability
+from app.rollup import rollup_merge
+from app.versions import versions
+from app.metrics import track_job
 from app.models import Reservation
 from uuid import uuid4
 import datetime
-from queue import PriorityQueue
+import time
 import os
 
 def get_requirements_query(reqs : str):
@@ -15,90 +19,388 @@ def get_requirements_query(reqs : str):
         query += f"INSERT INTO [dbo].[UserRequirements] (GroupId, RequirementId, Quantity) VALUES (@GroupID, {arr2[0]}, {arr2[1]});\n"
     return query
 
-async def create_confirmed_reservation(res: Reservation):
+def requirements_insert(groups):
+    """
+    Statements that write the dbo.UserRequirements rows of newly confirmed reservations.
+
+    `groups` is a SELECT returning GroupId and UserRequirements ("id=qty,id=qty"); every item
+    that parses becomes a row, and a group with none gets the default requirement (1, 1).
+    Shared by the allocation and instant booking batches so both store the same rows.
+    """
+    return f'''
+    INSERT INTO [dbo].[UserRequirements] (GroupId, RequirementId, Quantity)
+    SELECT confirmed.GroupId, r.RequirementId, r.Quantity
+    FROM ({groups}) AS confirmed
+    CROSS APPLY STRING_SPLIT(ISNULL(confirmed.UserRequirements, ''), ',') AS item
+    CROSS APPLY (SELECT
+        TRY_CAST(LEFT(item.value, CHARINDEX('=', item.value) - 1) AS INT) AS RequirementId,
+        TRY_CAST(SUBSTRING(item.value, CHARINDEX('=', item.value) + 1, 10) AS INT) AS Quantity
+    ) AS r
+    WHERE CHARINDEX('=', item.value) > 1 AND r.RequirementId IS NOT NULL AND r.Quantity IS NOT NULL;
+
+    INSERT INTO [dbo].[UserRequirements] (GroupId, RequirementId, Quantity)
+    SELECT confirmed.GroupId, 1, 1
+    FROM ({groups}) AS confirmed
+    WHERE NOT EXISTS (SELECT 1 FROM [dbo].[UserRequirements] ur WHERE ur.GroupId = confirmed.GroupId);
+    '''
+
+INSTANT_BOOK_SPACE_IDS = {int(space_id) for space_id in os.getenv("INSTANT_BOOK_SPACE_IDS", "").split(",") if space_id.strip()}
+
+# Claims the slot with a conditional UPDATE and, only if it won, writes the group, reservation,
+# statistics, requirements ("id=qty,id=qty") and rollup in the same transaction. The row lock
+# taken by the UPDATE makes a concurrent claim of the same slot wait and then match no row, so
+# a slot can never be booked twice, whatever worker the requests land on.
+INSTANT_BOOK_QUERY = """
+    SET NOCOUNT ON;
+    DECLARE @UserId INT = ?, @SpaceId INT = ?, @ScheduleId INT = ?, @UserRequirements NVARCHAR(4000) = ?, @GroupCode NVARCHAR(16) = ?;
+    DECLARE @GroupId INT;
+
+    UPDATE [dbo].[Schedule] SET Occupied = 1
+    WHERE ScheduleId = @ScheduleId AND SpaceId = @SpaceId AND Occupied = 0;
+
+    IF @@ROWCOUNT = 0
+    BEGIN
+        SELECT CAST(NULL AS INT);
+        RETURN;
+    END;
+
+    INSERT INTO [dbo].[ReservationGroup] (GroupCode) VALUES (@GroupCode);
+    SET @GroupId = SCOPE_IDENTITY();
+
+    INSERT INTO [dbo].[Reservation] (GroupId, UserId, SpaceId, ScheduleId, UserRequirements)
+    VALUES (@GroupId, @UserId, @SpaceId, @ScheduleId, @UserRequirements);
+
+    UPDATE [dbo].[Statistic] SET Reservations = Reservations + 1, StudyHours = StudyHours + 1 WHERE UserId = @UserId;
+""" + requirements_insert("""
+        SELECT @GroupId AS GroupId, @UserRequirements AS UserRequirements
+""") + rollup_merge("""
+        SELECT s.Day, s.SpaceId, ISNULL(u.Carrera, '') AS Carrera, 1 AS ActiveDelta, 0 AS CancelledDelta
+        FROM [dbo].[Schedule] s JOIN [dbo].[User] u ON u.UserId = @UserId
+        WHERE s.ScheduleId = @ScheduleId
+""") + """
+    SELECT @GroupId;
+"""
+
+def _instant_book(cursor, res, group_code):
+    row = cursor.execute(INSTANT_BOOK_QUERY, (res.user_id, res.space_id, res.schedule_id, res.user_requirements, group_code)).fetchone()
+    while cursor.nextset():
+        pass
+    return row is not None and row[0] is not None
+
+async def instant_book(res: Reservation):
+    """
+    Books `res` straight away, without going through PendingReservation and the allocation.
+    Returns the GroupCode of the confirmed reservation, or None if the slot was already taken.
+    """
+    group_code = str(uuid4())[:7]
+    async with DB() as db:
+        booked = await db.run_transaction(lambda cursor: _instant_book(cursor, res, group_code))
+    if not booked:
+        return None
+    availability.mark_occupied(res.schedule_id)
+    versions.bump_user(res.user_id)
+    versions.bump_space(res.space_id)
+    return group_code
+
+CANCEL_GROUP_QUERY = """
+    SET NOCOUNT ON;
+    DECLARE @GroupId INT;
+    DECLARE @Cancelled TABLE (ScheduleId INT, UserId INT, SpaceId INT);
+
+    SELECT @GroupId = GroupId FROM ReservationGroup where GroupCode = ?;
+
+    UPDATE [dbo].[Reservation] SET Deleted = 1
+    OUTPUT inserted.ScheduleId, inserted.UserId, inserted.SpaceId INTO @Cancelled
+    WHERE GroupId = @GroupId AND Deleted = 0;
+""" + rollup_merge("""
+        SELECT s.Day, c.SpaceId, ISNULL(u.Carrera, '') AS Carrera, -1 AS ActiveDelta, 1 AS CancelledDelta
+        FROM @Cancelled c
+        JOIN [dbo].[Schedule] s ON s.ScheduleId = c.ScheduleId
+        JOIN [dbo].[User] u ON u.UserId = c.UserId
+""") + """
+    SELECT DISTINCT UserId FROM @Cancelled;
+"""
+
+def _cancel_group(cursor, group_code):
+    cursor.execute(CANCEL_GROUP_QUERY, (group_code,))
+    return [row[0] for row in cursor.fetchall()]
+
+async def cancel_reservation_group(group_code):
+    """
+    Soft-deletes every reservation of a group and moves them from Active to Cancelled in the rollup.
+    Returns the ids of the users whose reservations were cancelled.
+    """
+    async with DB() as db:
+        user_ids = await db.run_transaction(lambda cursor: _cancel_group(cursor, group_code))
+    for user_id in user_ids:
+        versions.bump_user(user_id)
+    return user_ids
+
+SCHEDULE_HORIZON_DAYS = int(os.getenv("SCHEDULE_HORIZON_DAYS", "5"))
+
+# Used when dbo.SpaceHours has no rows: every space open Monday to Friday, 09:00 to 20:00.
+DEFAULT_OPEN_HOUR = datetime.time(9, 0)
+DEFAULT_CLOSE_HOUR = datetime.time(20, 0)
+DEFAULT_WEEKDAYS = range(0, 5)
+
+SLOT_TEMP_TABLE = """
+    DROP TABLE IF EXISTS #Slots;
+    CREATE TABLE #Slots (SpaceId INT, Day DATE, StartHour TIME(0), EndHour TIME(0));
+"""
+
+# Only inserts the slots that do not exist yet, so running the job twice (two workers,
+# a tenacity retry, a manual backfill) never duplicates a (SpaceId, Day, StartHour).
+SLOT_INSERT = """
+    SET NOCOUNT ON;
+
+    INSERT INTO [dbo].[Schedule] (SpaceId, Day, StartHour, EndHour, Occupied)
+    SELECT s.SpaceId, s.Day, s.StartHour, s.EndHour, 0
+    FROM #Slots s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM [dbo].[Schedule] sc WITH (UPDLOCK, HOLDLOCK)
+        WHERE sc.SpaceId = s.SpaceId AND sc.Day = s.Day AND sc.StartHour = s.StartHour
+    );
+
+    SELECT @@ROWCOUNT;
+
+    DROP TABLE #Slots;
+"""
+
+async def load_slot_templates(db):
+    """
+    Returns {weekday: [(SpaceId, OpenHour, CloseHour), ...]} with Monday as weekday 0.
+    """
+    templates = {}
+    rows = await db.execute_query("SELECT SpaceId, Weekday, OpenHour, CloseHour FROM [dbo].[SpaceHours];")
+    if rows:
+        for row in rows:
+            templates.setdefault(row[1], []).append((row[0], row[2], row[3]))
+        return templates
+
+    spaces = await db.execute_query("SELECT SpaceId FROM [dbo].[Space];") or []
+    for weekday in DEFAULT_WEEKDAYS:
+        templates[weekday] = [(row[0], DEFAULT_OPEN_HOUR, DEFAULT_CLOSE_HOUR) for row in spaces]
+    return templates
+
+def build_slots(templates, first_day, days):
+    slots = []
+    for offset in range(days):
+        day = first_day + datetime.timedelta(days=offset)
+        for space_id, open_hour, close_hour in templates.get(day.weekday(), []):
+            for hour in range(open_hour.hour, close_hour.hour):
+                slots.append((space_id, day, datetime.time(hour, 0), datetime.time(hour + 1, 0)))
+    return slots
+
+# Past free slots, except those a pending or confirmed reservation still points to: deleting
+# those would violate the foreign key and roll back the whole slot generation with it.
+PAST_SLOTS_DELETE = """
+    DELETE sc FROM [dbo].[Schedule] sc
+    WHERE sc.Day < ? AND sc.Occupied = 0
+        AND NOT EXISTS (SELECT 1 FROM [dbo].[PendingReservation] pr WHERE pr.ScheduleId = sc.ScheduleId)
+        AND NOT EXISTS (SELECT 1 FROM [dbo].[Reservation] re WHERE re.ScheduleId = sc.ScheduleId);
+"""
+
+def write_slots(cursor, today, slots):
+    cursor.execute(PAST_SLOTS_DELETE, (today,))
+    cursor.execute(SLOT_TEMP_TABLE)
+    if slots:
+        cursor.fast_executemany = True
+        cursor.executemany("INSERT INTO #Slots (SpaceId, Day, StartHour, EndHour) VALUES (?, ?, ?, ?);", slots)
+        cursor.fast_executemany = False
+    cursor.execute(SLOT_INSERT)
+    inserted = cursor.fetchone()[0]
+    while cursor.nextset():
+        pass
+    return inserted
+
+@track_job("create_new_schedules")
+async def create_new_schedules(horizon_days=None):
+    """
+    Removes past free slots and makes sure every slot from tomorrow up to `horizon_days`
+    ahead exists, following the opening hours in dbo.SpaceHours.
+
+    Safe to run any number of times; a missed run is caught up by the next one.
+    """
     try:
+        horizon_days = horizon_days or SCHEDULE_HORIZON_DAYS
+        today = datetime.date.today()
+
         async with DB() as db:
-            group_code = str(uuid4())[:7]
-            query =f'''
-                DECLARE @GroupID INT;
-                INSERT INTO [dbo].[ReservationGroup] (GroupCode)
-                OUTPUT INSERTED.GroupID
-                VALUES ('{group_code}');
-
-                SET @GroupID = SCOPE_IDENTITY(); 
-
-                INSERT INTO [dbo].[Reservation] (GroupId, UserId, SpaceId, ScheduleId, UserRequirements) 
-                VALUES (@GroupID, {res.user_id}, {res.space_id}, {res.schedule_id}, '{res.user_requirements}');
-
-                UPDATE [dbo].[Schedule] SET Occupied = 1 WHERE ScheduleId = {res.schedule_id};
-
-                UPDATE [dbo].[Statistic] SET Reservations = Reservations + 1, StudyHours = StudyHours + 1 WHERE UserId = {res.user_id};
-                
-                INSERT INTO [dbo].[UserRequirements] (GroupId, RequirementId, Quantity) VALUES (@GroupID, 1, 1);
-              '''
-            # if len(res.user_requirements) > 0:
-            #     query += get_requirements_query(res.user_requirements)
-            # print(query)
-            #params = (group_code, res.user_id, res.space_id, res.schedule_id, res.user_requirements, res.schedule_id, res.user_id)
-            results = await db.execute_query_insert(query=query)
-            return {"message": "Reservation created successfully", "results": results}
+            templates = await load_slot_templates(db)
+            slots = build_slots(templates, today + datetime.timedelta(days=1), horizon_days)
+            inserted = await db.run_transaction(lambda cursor: write_slots(cursor, today, slots))
+        await refresh_availability()
+        versions.bump_all()
+        summary = {"generated": len(slots), "inserted": inserted}
+        print(f"create_new_schedules: {summary}")
+        return summary
     except Exception as e:
-        print(e)
-
-async def create_new_schedules():
-        try:
-            hours = ["09:00", "10:00", "11:00", "12:00", "13:00", "14:00", "15:00", "16:00", "17:00", "18:00", "19:00", "20:00"]
-            today = (datetime.datetime.now().strftime("%Y-%m-%d"))
-            new_day = datetime.datetime.now() + datetime.timedelta(days=5)
-            
-            async with DB() as db:
-                delete_query = "DELETE FROM [dbo].[Schedule] WHERE Day < ? and Occupied = 0;"
-                delete_params = (today,)
-                await db.execute_query_insert(query=delete_query, params=delete_params)
-
-                if new_day.weekday() == 5 or new_day.weekday() == 6:
-                    return
-                new_day = new_day.strftime("%Y-%m-%d")
-
-                string_query = ""
-                for i in range(1, 16):
-                    for j in range(len(hours) -1):
-                        string_query += f"\nINSERT INTO [dbo].[Schedule] (SpaceId, Day, StartHour, EndHour, Occupied) VALUES ({i}, '{new_day}', '{hours[j]}', '{hours[j+1]}', 0);"
-                    string_query += "\n"
-                await db.execute_query_insert(query=string_query)
-        except Exception as e:
-            print(str(e))
-            raise e
-        
-async def assign_spaces():
+        print(str(e))
+        raise e
+
+# A request whose slot no longer exists is loaded as occupied: it can never win, but it is still
+# marked Processed instead of staying pending forever.
+PENDING_QUERY = """
+    SELECT 
+        PR.PendingReservationId, U.UserId, PR.ScheduleId, PR.UserRequirements, PR.SpaceId, PR.DateCreated, U.[Priority], ISNULL(S.Occupied, 1)
+    FROM 
+        [dbo].[PendingReservation] as PR 
+        JOIN [dbo].[User] as U on PR.Userid = U.UserId
+        LEFT JOIN [dbo].[Schedule] as S on PR.ScheduleId = S.ScheduleId
+    WHERE 
+        PR.Deleted = 0 and PR.Processed = 0 
+        {window}
+    ORDER BY 
+        PR.DateCreated ASC
+"""
+
+ALLOCATION_MODE = os.getenv("ALLOCATION_MODE", "daily")
+ALLOCATION_WINDOW_SECONDS = int(os.getenv("ALLOCATION_WINDOW_SECONDS", "300"))
+ALLOCATION_INTERVAL_SECONDS = int(os.getenv("ALLOCATION_INTERVAL_SECONDS", "60"))
+
+# Only the schedules whose request window has closed: their first pending request is at least
+# `window` seconds old, so everyone who asked within the window competes on Priority as before.
+PENDING_WINDOW_FILTER = """
+        AND PR.ScheduleId IN (
+            SELECT ScheduleId FROM [dbo].[PendingReservation]
+            WHERE Deleted = 0 AND Processed = 0
+            GROUP BY ScheduleId
+            HAVING MIN(DateCreated) <= DATEADD(second, -?, GETDATE())
+        )
+"""
+
+ALLOCATION_TEMP_TABLES = """
+    DROP TABLE IF EXISTS #Loaded;
+    DROP TABLE IF EXISTS #Winners;
+    DROP TABLE IF EXISTS #Groups;
+    CREATE TABLE #Loaded (PendingReservationId INT PRIMARY KEY);
+    CREATE TABLE #Winners (
+        PendingReservationId INT PRIMARY KEY, UserId INT, SpaceId INT, ScheduleId INT,
+        UserRequirements NVARCHAR(4000), GroupCode NVARCHAR(16)
+    );
+    CREATE TABLE #Groups (GroupId INT, PendingReservationId INT);
+"""
+
+# Applies every winner in one batch. Schedules that were taken since the pending rows were
+# loaded are dropped first (under UPDLOCK) so a slot can never be confirmed twice.
+ALLOCATION_WRITE = """
+    SET NOCOUNT ON;
+
+    DELETE w FROM #Winners w
+    JOIN [dbo].[Schedule] s WITH (UPDLOCK) ON s.ScheduleId = w.ScheduleId
+    WHERE s.Occupied = 1;
+
+    MERGE INTO [dbo].[ReservationGroup] AS target
+    USING #Winners AS w ON 1 = 0
+    WHEN NOT MATCHED THEN INSERT (GroupCode) VALUES (w.GroupCode)
+    OUTPUT inserted.GroupId, w.PendingReservationId INTO #Groups (GroupId, PendingReservationId);
+
+    INSERT INTO [dbo].[Reservation] (GroupId, UserId, SpaceId, ScheduleId, UserRequirements)
+    SELECT g.GroupId, w.UserId, w.SpaceId, w.ScheduleId, w.UserRequirements
+    FROM #Winners w JOIN #Groups g ON g.PendingReservationId = w.PendingReservationId;
+
+    UPDATE s SET Occupied = 1
+    FROM [dbo].[Schedule] s JOIN #Winners w ON w.ScheduleId = s.ScheduleId;
+
+    UPDATE st SET Reservations = st.Reservations + w.Total, StudyHours = st.StudyHours + w.Total
+    FROM [dbo].[Statistic] st
+    JOIN (SELECT UserId, COUNT(*) AS Total FROM #Winners GROUP BY UserId) w ON w.UserId = st.UserId;
+""" + requirements_insert("""
+        SELECT g.GroupId, w.UserRequirements
+        FROM #Groups g JOIN #Winners w ON w.PendingReservationId = g.PendingReservationId
+""") + rollup_merge("""
+        SELECT s.Day, w.SpaceId, ISNULL(u.Carrera, '') AS Carrera, 1 AS ActiveDelta, 0 AS CancelledDelta
+        FROM #Winners w
+        JOIN [dbo].[Schedule] s ON s.ScheduleId = w.ScheduleId
+        JOIN [dbo].[User] u ON u.UserId = w.UserId
+""") + """
+    UPDATE pr SET Processed = 1
+    FROM [dbo].[PendingReservation] pr JOIN #Loaded l ON l.PendingReservationId = pr.PendingReservationId;
+
+    SELECT w.ScheduleId, w.UserId, w.SpaceId FROM #Winners w;
+
+    DROP TABLE #Loaded;
+    DROP TABLE #Winners;
+    DROP TABLE #Groups;
+"""
+
+def pick_winners(rows):
+    """
+    Pick one pending request per free ScheduleId: lowest Priority first, then the oldest request.
+    """
+    winners = {}
+    for row in rows:
+        if row[7]:
+            continue
+        key = (row[6] if row[6] is not None else 0, row[5], row[0])
+        current = winners.get(row[2])
+        if current is None or key < current[0]:
+            winners[row[2]] = (key, row)
+    return [row for _, row in winners.values()]
+
+def write_allocation(cursor, pending_ids, winners):
+    cursor.execute(ALLOCATION_TEMP_TABLES)
+    cursor.fast_executemany = True
+    if pending_ids:
+        cursor.executemany("INSERT INTO #Loaded (PendingReservationId) VALUES (?);", [(i,) for i in pending_ids])
+    if winners:
+        cursor.executemany(
+            "INSERT INTO #Winners (PendingReservationId, UserId, SpaceId, ScheduleId, UserRequirements, GroupCode) VALUES (?, ?, ?, ?, ?, ?);",
+            [(row[0], row[1], row[4], row[2], row[3], str(uuid4())[:7]) for row in winners],
+        )
+    cursor.fast_executemany = False
+    cursor.execute(ALLOCATION_WRITE)
+    confirmed = [tuple(row) for row in cursor.fetchall()]
+    while cursor.nextset():
+        pass
+    return confirmed
+
+@track_job("assign_spaces")
+async def assign_spaces(window_seconds=None):
+    """
+    Confirm the winning pending reservation of every schedule in a single transaction.
+
+    With `window_seconds`, only the schedules whose first pending request is at least that old
+    are resolved (ALLOCATION_MODE=window); the others keep collecting requests.
+
+    Returns a summary with the number of rows processed and a timing breakdown (seconds)
+    of the load, in-memory selection and write phases.
+    """
     try:
         async with DB() as db:
-            query = """
-            SELECT 
-                PR.PendingReservationId, U.UserId, PR.ScheduleId, PR.UserRequirements, PR.SpaceId, PR.DateCreated, U.[Priority]
-            FROM 
-                [dbo].[PendingReservation] as PR JOIN [dbo].[User] as U on PR.Userid = U.UserId
-            WHERE 
-                Deleted = 0 and Processed = 0 
-            ORDER BY 
-                DateCreated ASC
-            """
-            results = await db.execute_query(query)
-            # check for duplicate schedule id in results
-            requests = {}
-            update_query = ""
+            started = time.perf_counter()
+            if window_seconds is None:
+                results = await db.execute_query(PENDING_QUERY.format(window=""))
+            else:
+                results = await db.execute_query(PENDING_QUERY.format(window=PENDING_WINDOW_FILTER), (window_seconds,))
+            if results is None:
+                raise Exception("Could not load pending reservations")
+            loaded = time.perf_counter()
+
+            winners = pick_winners(results)
+            selected = time.perf_counter()
+
+            pending_ids = [row[0] for row in results]
+            confirmed = await db.run_transaction(lambda cursor: write_allocation(cursor, pending_ids, winners))
+            written = time.perf_counter()
+            for schedule_id, user_id, space_id in confirmed:
+                availability.mark_occupied(schedule_id)
+                versions.bump_space(space_id)
             for row in results:
-                update_query += f"UPDATE [dbo].[PendingReservation] SET Processed = 1 WHERE PendingReservationId = {row[0]};\n"
-                if row[2] not in requests:
-                    requests[row[2]] = PriorityQueue()
-                requests[row[2]].put((row[6], row))
-            
-            for key in requests:
-                top = requests[key].get()[1]
-                res = Reservation(user_id=top[1], space_id=top[4], schedule_id=key, user_requirements=top[3])
-                await create_confirmed_reservation(res)
-            
-            await db.execute_query_insert(query=update_query)
+                versions.bump_user(row[1])
+
+            summary = {
+                "pending": len(results),
+                "schedules": len(winners),
+                "confirmed": len(confirmed),
+                "load_seconds": round(loaded - started, 4),
+                "select_seconds": round(selected - loaded, 4),
+                "write_seconds": round(written - selected, 4),
+                "total_seconds": round(written - started, 4),
+            }
+            if results or window_seconds is None:
+                print(f"assign_spaces: {summary}")
+            return summary
     except Exception as e:
         print(str(e))
-        raise e
\ No newline at end of file
+        raise e
@@ -0,0 +1,77 @@
+import os
+import asyncio
+import httpx
+
+CHATBOT_URL = os.getenv("CHATBOT_URL", "https://dlchatbot2.azurewebsites.net/chat/")
+# Streaming endpoint of the chatbot, required by /chat/stream (which answers 501 without it).
+# It takes the same JSON body as CHATBOT_URL, {"thread_id": ..., "message": ...}, and must send
+# the answer as a chunked plain-text body while it is generated; each chunk is relayed as an SSE event.
+CHATBOT_STREAM_URL = os.getenv("CHATBOT_STREAM_URL")
+CHATBOT_MAX_CONCURRENCY = int(os.getenv("CHATBOT_MAX_CONCURRENCY", "20"))
+CHATBOT_QUEUE_TIMEOUT = float(os.getenv("CHATBOT_QUEUE_TIMEOUT", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+
+
+class UpstreamBusyError(Exception):
+    pass
+
+
+class UpstreamClient:
+    """
+    Long-lived async HTTP client for one upstream service.
+
+    Connections are kept alive and reused between requests, every request has connect and
+    read timeouts, and at most `max_concurrency` requests are in flight at once; callers that
+    cannot get a slot within `queue_timeout` seconds get `UpstreamBusyError`.
+    """
+
+    def __init__(self, max_concurrency, queue_timeout):
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+            )
+        return self._client
+
+    async def _acquire(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise UpstreamBusyError("Too many requests to the upstream service, try again later")
+
+    async def post_json(self, url, data):
+        await self._acquire()
+        try:
+            response = await self.client.post(url, json=data)
+            return response.json()
+        finally:
+            self._slots.release()
+
+    async def stream_post(self, url, data):
+        """
+        Yields the upstream response body chunk by chunk as it arrives.
+        """
+        await self._acquire()
+        try:
+            async with self.client.stream("POST", url, json=data) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_text():
+                    yield chunk
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+chatbot_client = UpstreamClient(CHATBOT_MAX_CONCURRENCY, CHATBOT_QUEUE_TIMEOUT)
@@ -1,14 +1,27 @@
-from fastapi import FastAPI, HTTPException
-import requests
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse, Response
+from fastapi.exception_handlers import http_exception_handler
+import time
+import asyncio
+import httpx
 from app.models import ChatRequest
-from fastapi_utilities import repeat_at
-from app.db import DB
+from fastapi_utilities import repeat_at, repeat_every
+from app.db import DB, DBOverloadedError, pool, executor, replica_pool, replicas
+from app.versions import versions
+from app.passwords import passwords
+from app.write_behind import pending_writes
 from .routers import reservations, login, chatbot, admin, user
 import datetime
 from tenacity import retry, stop_after_attempt, wait_exponential
-from app.functions import create_new_schedules, assign_spaces
+from app.functions import create_new_schedules, assign_spaces, ALLOCATION_MODE, ALLOCATION_WINDOW_SECONDS, ALLOCATION_INTERVAL_SECONDS
+from app.scheduler import run_job, job_lease, daily_tick, DAILY_JOB_CRON
+from app.catalog import catalog
+from app.http_client import chatbot_client, CHATBOT_URL, CHATBOT_STREAM_URL, UpstreamBusyError
+from app.availability import refresh_availability, AVAILABILITY_RECONCILE_SECONDS
+from app.tags import tag_index, TAG_INDEX_REFRESH_SECONDS
+from app import metrics
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.include_router(reservations.router)
 app.include_router(chatbot.router)
@@ -16,6 +29,71 @@ app.include_router(login.router)
 app.include_router(admin.router)
 app.include_router(user.router)
 
+metrics.registry.gauges("db_executor", "DB executor state", executor.stats)
+metrics.registry.gauges("db_pool", "Connection pool state", pool.stats)
+metrics.registry.gauges("db_replica", "Read routing", replicas.stats)
+if replica_pool is not None:
+    metrics.registry.gauges("db_replica_pool", "Read replica connection pool state", replica_pool.stats)
+metrics.registry.gauges("bcrypt_pool", "Password hashing pool state", passwords.stats)
+metrics.registry.gauges("pending_write_behind", "PendingReservation write-behind batching", pending_writes.stats)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not the raw path, so ids in the URL do not explode the series count
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.http_request_duration.observe(time.perf_counter() - started, request.method, path)
+        metrics.http_requests.inc(request.method, path, status)
+
+@app.middleware("http")
+async def pin_reads_after_writes(request: Request, call_next):
+    # Read-your-writes across workers: the client carries the time of its last write
+    versions.begin_request(request)
+    response = await call_next(request)
+    versions.end_request(response, replicas.staleness)
+    return response
+
+@app.exception_handler(DBOverloadedError)
+async def database_overloaded(request: Request, e: DBOverloadedError):
+    return ORJSONResponse(status_code=503, content={"detail": str(e)})
+
+@app.exception_handler(HTTPException)
+async def http_error(request: Request, e: HTTPException):
+    # The routers turn every error into a 500; an overloaded pool or executor is a 503 so clients back off
+    if e.status_code == 500 and isinstance(e.__context__, DBOverloadedError):
+        return await database_overloaded(request, e.__context__)
+    return await http_exception_handler(request, e)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.on_event("startup")
+async def warm_up_pool():
+    try:
+        await pool.warm_up()
+        if replica_pool is not None:
+            await replica_pool.warm_up()
+    except Exception as e:
+        print(f"Could not warm up the connection pool: {e}")
+
+@app.on_event("shutdown")
+async def close_pool():
+    await pending_writes.close()
+    await pool.close()
+    if replica_pool is not None:
+        await replica_pool.close()
+    executor.shutdown()
+    passwords.shutdown()
+    await chatbot_client.close()
+
 @app.get("/")
 async def root():
     return {"message": "V7", "Time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
@@ -25,37 +103,104 @@ async def root():
 @app.post("/chat")
 async def chat(chat_request: ChatRequest):
     try:
-        chatbot_url = "https://dlchatbot2.azurewebsites.net/chat/"
         data = {
             "thread_id": chat_request.session_id,
             "message": chat_request.prompt
         }
-        response = requests.post(chatbot_url, json=data)
-        return response.json()
+        return await chatbot_client.post_json(CHATBOT_URL, data)
+    except UpstreamBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="The chatbot took too long to answer")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(chat_request: ChatRequest):
+    """
+    Same as /chat, but relays the bot's answer as Server-Sent Events while it is generated.
+    Each upstream chunk is sent as a `data:` event and the stream ends with `event: done`.
+    Answers 501 when no CHATBOT_STREAM_URL is configured.
+    """
+    if not CHATBOT_STREAM_URL:
+        raise HTTPException(status_code=501, detail="Chat streaming is not configured (CHATBOT_STREAM_URL)")
+    data = {
+        "thread_id": chat_request.session_id,
+        "message": chat_request.prompt
+    }
+
+    async def events():
+        try:
+            async for chunk in chatbot_client.stream_post(CHATBOT_STREAM_URL, data):
+                yield "".join(f"data: {line}\n" for line in chunk.split("\n")) + "\n"
+            yield "event: done\ndata: \n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {e}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/areas")
 async def get_areas():
     try:
-        async with DB() as db:
-            query = "SELECT * FROM [dbo].[Space]"
-            results = await db.execute_query(query)
-            formatted_results = []
-            print(results)
-            for row in results:
-                formatted_results.append({
-                    'SpaceId': row[0],
-                    'SpaceName': row[1],
-                    'description': row[3],
-                })
-            return formatted_results
+        return [
+            {
+                'SpaceId': space.space_id,
+                'SpaceName': space.name,
+                'description': space.description,
+            }
+            for space in await catalog.spaces()
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.on_event("startup")
-@repeat_at(cron='0 6 * * *')
 @retry(stop=stop_after_attempt(5), wait=wait_exponential())
-async def schedules():
-    await create_new_schedules()
-    await assign_spaces()
\ No newline at end of file
+async def schedules(tick=None):
+    tick = tick or daily_tick()
+    await run_job("create_new_schedules", tick, create_new_schedules)
+    if ALLOCATION_MODE == "daily":
+        await run_job("assign_spaces", tick, assign_spaces)
+
+@app.on_event("startup")
+@repeat_at(cron=DAILY_JOB_CRON)
+async def run_daily_jobs():
+    await schedules()
+
+async def catch_up_daily_jobs():
+    try:
+        await schedules()
+    except Exception as e:
+        print(f"Could not catch up the daily jobs: {e}")
+
+@app.on_event("startup")
+async def start_daily_jobs_catch_up():
+    # Runs the latest tick in the background if it was missed (deploy or outage at DAILY_JOB_HOUR);
+    # dbo.JobRun makes it a no-op otherwise
+    app.state.catch_up = asyncio.create_task(catch_up_daily_jobs())
+
+@app.on_event("startup")
+@repeat_every(seconds=ALLOCATION_INTERVAL_SECONDS)
+async def allocate_closed_windows():
+    if ALLOCATION_MODE != "window":
+        return
+    try:
+        async with job_lease("assign_spaces") as leader:
+            if leader:
+                await assign_spaces(window_seconds=ALLOCATION_WINDOW_SECONDS)
+    except Exception as e:
+        print(f"Could not allocate the closed request windows: {e}")
+
+@app.on_event("startup")
+@repeat_every(seconds=AVAILABILITY_RECONCILE_SECONDS)
+async def reconcile_availability():
+    try:
+        await refresh_availability()
+    except Exception as e:
+        print(f"Could not refresh the availability index: {e}")
+
+@app.on_event("startup")
+@repeat_every(seconds=TAG_INDEX_REFRESH_SECONDS)
+async def reload_tag_index():
+    try:
+        await tag_index.reload()
+    except Exception as e:
+        print(f"Could not load the TagId index: {e}")
@@ -0,0 +1,187 @@
+import time
+import threading
+import functools
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets. Observing only bumps one bucket; the cumulative counts are
+    worked out when the registry is rendered.
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        for label_values, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class GaugeCollector:
+    """
+    Gauges read at scrape time from a callback returning {metric suffix: value}, e.g. the
+    `stats()` dicts of the DB executor and connection pool.
+    """
+
+    def __init__(self, prefix, documentation, collect):
+        self.prefix = prefix
+        self.documentation = documentation
+        self.collect = collect
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.collect().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{key}"
+            lines.append(f"# HELP {name} {self.documentation} ({key})")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauges(self, prefix, documentation, collect):
+        return self.register(GaugeCollector(prefix, documentation, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Could not render metric {getattr(metric, 'name', getattr(metric, 'prefix', metric))}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests by route and status code.", ("method", "route", "status"))
+http_request_duration = registry.histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+db_query_duration = registry.histogram("db_query_duration_seconds", "Database call latency by operation.", ("operation",))
+db_query_errors = registry.counter("db_query_errors_total", "Database calls that raised a driver error, by operation.", ("operation",))
+db_connections_opened = registry.counter("db_connections_opened_total", "Database connections opened by the pool.")
+db_connections_closed = registry.counter("db_connections_closed_total", "Database connections closed by the pool.")
+job_duration = registry.histogram("job_duration_seconds", "Scheduled job run time.", ("job",), buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+job_runs = registry.counter("job_runs_total", "Scheduled job runs by outcome.", ("job", "status"))
+job_rows = registry.counter("job_rows_total", "Rows handled by scheduled jobs, by the count reported in their summary.", ("job", "kind"))
+
+
+def track_job(name):
+    """
+    Decorator recording duration, outcome and the integer counts of the returned summary dict of a job.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                summary = await fn(*args, **kwargs)
+            except Exception:
+                job_runs.inc(name, "error")
+                raise
+            finally:
+                job_duration.observe(time.perf_counter() - started, name)
+            job_runs.inc(name, "ok")
+            if isinstance(summary, dict):
+                for kind, value in summary.items():
+                    if isinstance(value, int) and not isinstance(value, bool):
+                        job_rows.inc(name, kind, amount=value)
+            return summary
+        return wrapper
+    return decorator
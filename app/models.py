@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List 
+from typing import List, Optional
 
 class User(BaseModel):
     username: str = None
@@ -46,3 +46,21 @@ class Statistic(BaseModel):
     reservations: int = 0
     study_hours: int = 0
     explored_areas: int = 0
+
+class Zone(BaseModel):
+    zone_id: int
+    zone_name: Optional[str] = None
+    description: Optional[str] = None
+    goal: int = 0
+
+class Space(BaseModel):
+    space_id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    zone_id: Optional[int] = None
+
+class SpaceRequirement(BaseModel):
+    space_id: int
+    requirement_id: int
+    requirement_name: Optional[str] = None
+    max_quantity: Optional[int] = None
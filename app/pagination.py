@@ -0,0 +1,66 @@
+import os
+import json
+import base64
+import datetime
+from fastapi import HTTPException
+
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "500"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "1000"))
+
+# The body of a paginated endpoint stays a plain list; the cursor of the next page, if
+# there is one, is returned in this header and sent back as the `cursor` query parameter.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def page_limit(limit, cursor=None):
+    """
+    Page size for `limit`, or None when neither `limit` nor `cursor` was sent: callers that
+    predate pagination keep getting the complete list.
+    """
+    if limit is None:
+        return PAGE_DEFAULT_LIMIT if cursor is not None else None
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return min(limit, PAGE_MAX_LIMIT)
+
+
+def encode_cursor(*values):
+    values = [value.isoformat() if isinstance(value, datetime.date) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, *converters):
+    """
+    Decodes a cursor made by `encode_cursor`, applying one converter per key column
+    (e.g. `datetime.date.fromisoformat, int`). Returns None when there is no cursor.
+    """
+    if cursor is None:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if len(values) != len(converters):
+            raise ValueError
+        return tuple(convert(value) for convert, value in zip(converters, values))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def top(limit):
+    """
+    The TOP clause and its parameters that fetch one row more than a page of `limit`, or no
+    clause at all when unpaginated (limit None).
+    """
+    if limit is None:
+        return "", []
+    return "TOP (?)", [limit + 1]
+
+
+def paginate(response, rows, limit, key):
+    """
+    Trims `rows` (fetched with limit + 1) to one page and sets the next-cursor header from
+    the key of the last row kept when more rows exist. Unpaginated rows (limit None) are kept whole.
+    """
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(rows[-1]))
+    return rows
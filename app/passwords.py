@@ -0,0 +1,107 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+def _as_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+# The worker functions return the wall-clock time they started at so the parent can tell
+# time spent queued for a process apart from time spent hashing.
+def _hash(password, rounds):
+    started_at = time.time()
+    return started_at, bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    started_at = time.time()
+    return started_at, bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed):
+    """
+    Work factor of a '$2b$<rounds>$...' bcrypt hash, or None if it cannot be read.
+    """
+    try:
+        return int(_as_bytes(hashed).split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a process pool so login storms use every core
+    instead of blocking the event loop one hash at a time.
+    """
+
+    def __init__(self, workers=BCRYPT_WORKERS, rounds=BCRYPT_ROUNDS):
+        self.workers = workers
+        self.rounds = rounds
+        self._executor = None
+        self._waiting = 0
+        self._calls = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            # spawn, not fork: the parent already runs the DB executor threads and their locks
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def _run(self, fn, *args):
+        submitted_at = time.time()
+        self._waiting += 1
+        try:
+            started_at, result = await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self._waiting -= 1
+        finished_at = time.time()
+        self._record(max(started_at - submitted_at, 0.0), finished_at - max(started_at, submitted_at))
+        return result
+
+    def _record(self, waited, ran):
+        self._calls += 1
+        self._wait_total += waited
+        self._run_total += ran
+        self._wait_max = max(self._wait_max, waited)
+        self._run_max = max(self._run_max, ran)
+
+    async def hash(self, password):
+        return await self._run(_hash, _as_bytes(password), self.rounds)
+
+    async def verify(self, password, hashed):
+        return await self._run(_check, _as_bytes(password), _as_bytes(hashed))
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "in_flight": self._waiting,
+            "calls": self._calls,
+            "wait_seconds_total": self._wait_total,
+            "wait_seconds_max": self._wait_max,
+            "run_seconds_total": self._run_total,
+            "run_seconds_max": self._run_max,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+passwords = PasswordHasher()
@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import threading
+import datetime
+from collections import deque
+from functools import lru_cache
+import orjson
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_WINDOW_SECONDS = float(os.getenv("SLOW_QUERY_WINDOW_SECONDS", "3600"))
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "500"))
+SLOW_QUERY_RECENT = int(os.getenv("SLOW_QUERY_RECENT", "100"))
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w@#$])-?(?:0x[0-9a-fA-F]+|\d+(?:\.\d+)?)\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+# Runs after _LISTS, so a multi-column row is already '(?...)' by then
+_VALUES = re.compile(r"(\(\?(?:\.\.\.)?\))(?:\s*,\s*\(\?(?:\.\.\.)?\))+")
+_SPACES = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(query):
+    """
+    The statement with comments stripped, literals replaced by '?', IN/VALUES lists collapsed and
+    whitespace squeezed, so f-string SQL that only differs in its values groups together.
+    """
+    normalized = _COMMENTS.sub(" ", query)
+    normalized = _STRINGS.sub("?", normalized)
+    normalized = _NUMBERS.sub("?", normalized)
+    normalized = _LISTS.sub("(?...)", normalized)
+    normalized = _VALUES.sub(r"\1, ...", normalized)
+    return _SPACES.sub(" ", normalized).strip()
+
+
+class QueryLog:
+    """
+    Per-fingerprint call count, execution time and fetch time over a rolling window, plus a log
+    of the statements that took longer than `threshold_ms`.
+
+    The window is kept as the current and the previous period of `window` seconds, so the summary
+    always covers between one and two periods. Called from the DB executor threads.
+    """
+
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, window=SLOW_QUERY_WINDOW_SECONDS, max_fingerprints=SLOW_QUERY_MAX_FINGERPRINTS, recent=SLOW_QUERY_RECENT):
+        self.threshold = threshold_ms / 1000
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._current = {}
+        self._previous = {}
+        self._period_started = time.monotonic()
+        self.slow = deque(maxlen=recent)
+
+    def _rotate(self, now):
+        if now - self._period_started >= self.window:
+            stale = now - self._period_started >= 2 * self.window
+            self._previous = {} if stale else self._current
+            self._current = {}
+            self._period_started = now
+
+    def record(self, query, execute_seconds, fetch_seconds, rows):
+        key = fingerprint(query)
+        total = execute_seconds + fetch_seconds
+        with self._lock:
+            self._rotate(time.monotonic())
+            entry = self._current.get(key)
+            if entry is None:
+                if len(self._current) >= self.max_fingerprints:
+                    # Evict the cheapest fingerprint so a flood of one-off statements cannot grow the table
+                    del self._current[min(self._current, key=lambda k: self._current[k][1] + self._current[k][2])]
+                entry = self._current[key] = [0, 0.0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += execute_seconds
+            entry[2] += fetch_seconds
+            entry[3] = max(entry[3], total)
+            entry[4] += rows
+
+        if total >= self.threshold:
+            event = {
+                "event": "slow_query",
+                "at": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "fingerprint": key,
+                "execute_ms": round(execute_seconds * 1000, 1),
+                "fetch_ms": round(fetch_seconds * 1000, 1),
+                "rows": rows,
+            }
+            self.slow.append(event)
+            print(orjson.dumps(event).decode())
+
+    def summary(self, limit=20):
+        """
+        The `limit` fingerprints with the most total time in the window, most expensive first.
+        """
+        with self._lock:
+            self._rotate(time.monotonic())
+            merged = {}
+            for period in (self._previous, self._current):
+                for key, (calls, execute, fetch, worst, rows) in period.items():
+                    entry = merged.setdefault(key, [0, 0.0, 0.0, 0.0, 0])
+                    entry[0] += calls
+                    entry[1] += execute
+                    entry[2] += fetch
+                    entry[3] = max(entry[3], worst)
+                    entry[4] += rows
+
+        top = sorted(merged.items(), key=lambda item: item[1][1] + item[1][2], reverse=True)[:limit]
+        return [{
+            "fingerprint": key,
+            "calls": calls,
+            "total_ms": round((execute + fetch) * 1000, 1),
+            "execute_ms": round(execute * 1000, 1),
+            "fetch_ms": round(fetch * 1000, 1),
+            "avg_ms": round((execute + fetch) * 1000 / calls, 2),
+            "max_ms": round(worst * 1000, 1),
+            "rows": rows,
+        } for key, (calls, execute, fetch, worst, rows) in top]
+
+
+query_log = QueryLog()
+
+
+class TimedCursor:
+    """
+    Wraps a pyodbc cursor and reports every statement to the query log, timing `execute` apart
+    from the fetches that follow it. A statement is reported when the next one starts or on `flush()`.
+    """
+
+    def __init__(self, cursor, log=query_log):
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_log", log)
+        object.__setattr__(self, "_statement", None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def flush(self):
+        statement = self._statement
+        if statement is not None:
+            object.__setattr__(self, "_statement", None)
+            self._log.record(*statement)
+
+    def _run(self, method, query, args):
+        self.flush()
+        started = time.perf_counter()
+        method(query, *args)
+        object.__setattr__(self, "_statement", [query, time.perf_counter() - started, 0.0, 0])
+        return self
+
+    def execute(self, query, *args):
+        return self._run(self._cursor.execute, query, args)
+
+    def executemany(self, query, *args):
+        return self._run(self._cursor.executemany, query, args)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        statement = self._statement
+        if statement is not None:
+            statement[2] += time.perf_counter() - started
+            if isinstance(result, list):
+                statement[3] += len(result)
+            elif result is not None and not isinstance(result, bool):
+                statement[3] += 1
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def nextset(self):
+        return self._fetch(self._cursor.nextset)
+
+    def close(self):
+        self.flush()
+        self._cursor.close()
@@ -0,0 +1,75 @@
+import sys
+import asyncio
+import datetime
+from app.db import DB
+
+
+def rollup_merge(changes):
+    """
+    MERGE statement that adds the deltas of `changes` to dbo.DailyReservationRollup.
+
+    `changes` is a SELECT returning Day, SpaceId, Carrera, ActiveDelta and CancelledDelta;
+    it is embedded in the batch that made the change so both commit together.
+    """
+    return f'''
+    MERGE INTO [dbo].[DailyReservationRollup] WITH (HOLDLOCK) AS target
+    USING (
+        SELECT Day, SpaceId, Carrera, SUM(ActiveDelta) AS ActiveDelta, SUM(CancelledDelta) AS CancelledDelta
+        FROM ({changes}) AS changes
+        GROUP BY Day, SpaceId, Carrera
+    ) AS source
+    ON target.Day = source.Day AND target.SpaceId = source.SpaceId AND target.Carrera = source.Carrera
+    WHEN MATCHED THEN
+        UPDATE SET Active = target.Active + source.ActiveDelta, Cancelled = target.Cancelled + source.CancelledDelta
+    WHEN NOT MATCHED THEN
+        INSERT (Day, SpaceId, Carrera, Active, Cancelled)
+        VALUES (source.Day, source.SpaceId, source.Carrera, source.ActiveDelta, source.CancelledDelta);
+    '''
+
+
+REBUILD_QUERY = '''
+    SET NOCOUNT ON;
+
+    DELETE FROM [dbo].[DailyReservationRollup] WITH (TABLOCKX) WHERE Day >= ?;
+
+    INSERT INTO [dbo].[DailyReservationRollup] (Day, SpaceId, Carrera, Active, Cancelled)
+    SELECT
+        s.Day,
+        r.SpaceId,
+        ISNULL(u.Carrera, ''),
+        SUM(CASE WHEN r.Deleted = 0 THEN 1 ELSE 0 END),
+        SUM(CASE WHEN r.Deleted = 1 THEN 1 ELSE 0 END)
+    FROM [dbo].[Reservation] r
+    JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
+    JOIN [dbo].[User] u ON r.UserId = u.UserId
+    WHERE s.Day >= ?
+    GROUP BY s.Day, r.SpaceId, ISNULL(u.Carrera, '');
+
+    SELECT @@ROWCOUNT;
+'''
+
+
+def _rebuild(cursor, since):
+    cursor.execute(REBUILD_QUERY, (since, since))
+    rows = cursor.fetchone()[0]
+    while cursor.nextset():
+        pass
+    return rows
+
+
+async def rebuild_rollup(since=None):
+    """
+    Recomputes the rollup from the raw reservations, for every day or only from `since` on.
+    Returns the number of rollup rows written.
+    """
+    since = since or datetime.date(1900, 1, 1)
+    async with DB() as db:
+        rows = await db.run_transaction(lambda cursor: _rebuild(cursor, since))
+    print(f"DailyReservationRollup rebuilt from {since}: {rows} rows")
+    return rows
+
+
+if __name__ == "__main__":
+    # python -m app.rollup [YYYY-MM-DD]
+    since = datetime.date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    asyncio.run(rebuild_rollup(since))
@@ -1,11 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from app.models import Reservation, DeleteReservation, ReservationBot, ReservationAdmin, AreasFrecuentes
 from app.db import DB
 from app.dependencies import check_api_key
 from uuid import uuid4
 from app.functions import get_requirements_query
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from typing import List 
+import unicodedata
+from app.availability import availability
+from app.catalog import catalog
+from app.versions import versions
+from app.write_behind import insert_pending_reservation
+from app.formatting import row_mapper, format_date, format_time, format_date_es, json_response
+from app.rollup import rebuild_rollup
+from app.query_log import query_log
+from app.pagination import page_limit, decode_cursor, paginate, top
+from app.export import reservations_export_query, stream_csv, stream_xlsx, xlsxwriter
+from app.statistics import reservation_counts, summarize, frequent_spaces, zone_space_ids, zone_statistics
 
 router = APIRouter(
     prefix="/admin",
@@ -14,13 +26,33 @@ router = APIRouter(
 )
 
 
+map_admin_reservation = row_mapper(
+    ('Day', 2, format_date),
+    ('StartHour', 3, format_time),
+    ('EndHour', 4, format_time),
+    ('SpaceName', 5, str),
+    ('SpaceId', 6),
+    ('GroupCode', 8, str),
+    ('Name', 0, str),
+    ('Matricula', 1, str),
+    ('UserId', 7),
+    ('Fecha', 2, format_date_es),
+)
+
 @router.get("/reservations")
-async def get_Reservations():
+async def get_Reservations(response: Response, limit: int = None, cursor: str = None):
+    """
+    Upcoming reservations ordered by (Day, ScheduleId, GroupId), one page at a time.
+    The cursor of the next page is returned in the X-Next-Cursor header; without `limit`
+    and `cursor` every reservation is returned at once.
+    """
+    page_size = page_limit(limit, cursor)
+    after = decode_cursor(cursor, date.fromisoformat, int, int)
     try:
-        async with DB() as db:
+        async with DB(read_only=True) as db:
             query = '''
 
-            SELECT [User].[Name], [User].[UserName], [Schedule].[Day], [Schedule].[StartHour], [Schedule].[EndHour], [Space].[Name], [Space].[SpaceId], [User].[UserId], [ReservationGroup].[GroupCode]
+            SELECT {top} [User].[Name], [User].[UserName], [Schedule].[Day], [Schedule].[StartHour], [Schedule].[EndHour], [Space].[Name], [Space].[SpaceId], [User].[UserId], [ReservationGroup].[GroupCode], [Reservation].[ScheduleId], [Reservation].[GroupId]
             FROM [dbo].[User]
             INNER JOIN [dbo].[Reservation]
                 ON [dbo].[User].[UserId] = [dbo].[Reservation].[UserId]
@@ -33,54 +65,28 @@ async def get_Reservations():
             WHERE 
                 [dbo].[Schedule].[Day] >= CAST(GETDATE() AS Date) 
                 AND [dbo].[Reservation].[Deleted] = 0
-
+                {after}
+            ORDER BY [Schedule].[Day], [Reservation].[ScheduleId], [Reservation].[GroupId]
 
             '''
-            results = await db.execute_query(query)
+            top_clause, params = top(page_size)
+            if after:
+                query = query.format(top=top_clause, after='''AND ([Schedule].[Day] > ? OR ([Schedule].[Day] = ? AND ([Reservation].[ScheduleId] > ?
+                    OR ([Reservation].[ScheduleId] = ? AND [Reservation].[GroupId] > ?))))''')
+                params += [after[0], after[0], after[1], after[1], after[2]]
+            else:
+                query = query.format(top=top_clause, after="")
+            results = paginate(response, await db.execute_query(query, params), page_size, lambda row: (row[2], row[9], row[10]))
 
             
-            formatted_results = []
-            for row in results:
-                # Convert date to written format
-                day = row[2].day
-                month = row[2].strftime('%B')
-                year = row[2].year
-                month_in_spanish = {
-                    'January': 'Enero',
-                    'February': 'Febrero',
-                    'March': 'Marzo',
-                    'April': 'Abril',
-                    'May': 'Mayo',
-                    'June': 'Junio',
-                    'July': 'Julio',
-                    'August': 'Agosto',
-                    'September': 'Septiembre',
-                    'October': 'Octubre',
-                    'November': 'Noviembre',
-                    'December': 'Diciembre'
-                }
-                formatted_date = f"{day} de {month_in_spanish[month]} {year}"
-
-                formatted_results.append({
-                    'Day': f"{row[2]}",
-                    'StartHour': f"{row[3].strftime('%H:%M')}",
-                    'EndHour': f"{row[4].strftime('%H:%M')}",
-                    "SpaceName": f"{row[5]}",
-                    "SpaceId": row[6],
-                    "GroupCode": f"{row[8]}",
-                    'Name': f"{row[0]}",
-                    'Matricula': f"{row[1]}",
-                    'UserId': row[7],
-                    'Fecha': {formatted_date},
-                })
-            return formatted_results
+            return json_response([map_admin_reservation(row) for row in results], response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.get("/reservationstype")
 async def get_Reservations():
     try:
-        async with DB() as db:
+        async with DB(read_only=True) as db:
             query = '''
 
             SELECT [User].[Name], [User].[UserName], [Schedule].[Day], [Schedule].[StartHour], [Schedule].[EndHour], [Space].[Name], [Space].[SpaceId], [User].[UserId], [ReservationGroup].[GroupCode]
@@ -98,24 +104,36 @@ async def get_Reservations():
 
             '''
             results = await db.execute_query(query)
-
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'Day': f"{row[2]}"
-                })
-            return formatted_results
+            return json_response([{'Day': format_date(row[2])} for row in results])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+map_admin_pending = row_mapper(
+    ('PendingReservationId', 0),
+    ('UserId', 1),
+    ('Name', 2),
+    ('Matricula', 3),
+    ('SpaceId', 4),
+    ('SpaceName', 5, str),
+    ('Day', 6, format_date),
+    ('StartHour', 7, format_time),
+    ('EndHour', 8, format_time),
+)
+
 @router.get("/pending")
-async def get_Pending():
+async def get_Pending(response: Response, limit: int = None, cursor: str = None):
+    """
+    Today's unprocessed pending reservations ordered by PendingReservationId, one page at a time.
+    The cursor of the next page is returned in the X-Next-Cursor header; without `limit`
+    and `cursor` every pending reservation is returned at once.
+    """
+    page_size = page_limit(limit, cursor)
+    after = decode_cursor(cursor, int)
     try:
-        async with DB() as db:
+        async with DB(read_only=True) as db:
             query = '''
 
-            SELECT 
+            SELECT {top}
                 pr.[PendingReservationId], 
                 pr.[UserId], 
                 u.[Name] AS UserName, 
@@ -136,26 +154,19 @@ async def get_Pending():
             WHERE 
                 pr.[DateCreated] >= CAST(GETDATE() AS Date)
                 AND pr.[Processed] = 0
-                AND pr.[Deleted] = 0;
+                AND pr.[Deleted] = 0
+                AND pr.[PendingReservationId] > ?
+            ORDER BY
+                pr.[PendingReservationId];
 
             '''
-            results = await db.execute_query(query)
+            top_clause, params = top(page_size)
+            query = query.format(top=top_clause)
+            params.append(after[0] if after else 0)
+            results = paginate(response, await db.execute_query(query, params), page_size, lambda row: (row[0],))
 
             
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    "PendingReservationId": row[0],
-                    "UserId": row[1],
-                    "Name": row[2],
-                    "Matricula": row[3],
-                    "SpaceId": row[4],
-                    "SpaceName": f"{row[5]}",
-                    "Day": f"{row[6]}",
-                    "StartHour": f"{row[7].strftime('%H:%M')}",
-                    "EndHour": f"{row[8].strftime('%H:%M')}"
-                })
-            return formatted_results
+            return json_response([map_admin_pending(row) for row in results], response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -180,522 +191,236 @@ async def create_reservation(res: ReservationAdmin):
             
             user_id = user_results[0][0] 
 
-            reservation_query = "INSERT INTO [dbo].[PendingReservation] (UserId, SpaceId, ScheduleId, UserRequirements) VALUES (?, ?, ?, ?);"
-            params = (user_id, res.space_id, res.schedule_id, res.user_requirements)
-            results = await db.execute_query_insert(reservation_query, params)
-            return {"message": "Reservation created successfully"}
+        await insert_pending_reservation(user_id, res.space_id, res.schedule_id, res.user_requirements)
+        versions.bump_user(user_id)
+        return {"message": "Reservation created successfully"}
     except Exception as e:
         raise HTTPException(status_code=404, detail=str("User not found"))
 
+def zone_slug(name):
+    """
+    'Exploración' -> 'exploracion': the form the legacy dashboard routes use for a zone name.
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    return "".join(c for c in decomposed if c.isalnum() and not unicodedata.combining(c)).lower()
+
+async def legacy_zone(name):
+    """
+    Space ids and goal of the zone whose ZoneName matches the legacy route `name`, or of every
+    space when `name` is None.
+    """
+    zones = await catalog.zones()
+    if name is None:
+        return await zone_space_ids(), sum(zone.goal for zone in zones)
+    zone = next((zone for zone in zones if zone.zone_name is not None and zone_slug(zone.zone_name) == name), None)
+    if zone is None:
+        raise HTTPException(status_code=404, detail="Zone not found")
+    return await zone_space_ids(zone.zone_id), zone.goal
+
+def legacy_statistics(summary):
+    return [
+        {"NoCanceladasPorcentaje": summary["NoCanceladasPorcentaje"]},
+        {"CanceladasPorcentaje": summary["CanceladasPorcentaje"]},
+        {"RestanteMeta": summary["RestanteMeta"]},
+        {"ActualMeta": summary["ActualMeta"]},
+        {"ITC": summary["Carreras"]["ITC"]},
+        {"ITD": summary["Carreras"]["ITD"]},
+        {"IRS": summary["Carreras"]["IRS"]},
+    ]
+
+
+@router.get("/estadisticas")
+async def get_zone_statistics():
+    """
+    Statistics of the last 30 days for every zone at once, plus a "General" entry.
+
+    Returns:
+        list: One dictionary per zone with ZoneId, Zone, NoCanceladas, Canceladas,
+        NoCanceladasPorcentaje, CanceladasPorcentaje, Meta, RestanteMeta, ActualMeta
+        and Carreras (active reservations per Carrera).
+    """
+    try:
+        return await zone_statistics()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/areasfrecuentesgeneral")
 async def get_Pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT r.SpaceId, COUNT(*) AS TotalReservations
-            FROM [dbo].[Reservation] r
-            JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-            WHERE r.SpaceId IN (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15)
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.Deleted = 0
-            GROUP BY r.SpaceId
-            ORDER BY TotalReservations DESC;
-                        '''
-            results = await db.execute_query(query)
-
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    row[0]: row[1],
-                })
-            return formatted_results
+        space_ids, _ = await legacy_zone(None)
+        rows = await reservation_counts()
+        return [{space_id: total} for space_id, total in frequent_spaces(rows, space_ids)]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-
 @router.get("/estadisticasgeneral")
 async def get_pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT 
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 0 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                ) AS NoCanceladas,
-                
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 1 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                ) AS Canceladas,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'ITC'
-                ) AS ITC,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'ITD'
-                ) AS ITD,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'IRS'
-                ) AS IRS;
-
-                
-            '''
-            results = await db.execute_query(query)
-            no_canceladas = results[0][0]
-            total_reservas = no_canceladas + results[0][1]
-            no_canceladas_porcentaje = round((no_canceladas / total_reservas * 100), 0) if total_reservas > 0 else 0
-            canceladas_porcentaje = round((results[0][1] / total_reservas * 100), 0) if total_reservas > 0 else 0
-            meta_restante = 100 - no_canceladas
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    "NoCanceladasPorcentaje": no_canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "CanceladasPorcentaje": canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "RestanteMeta": meta_restante,
-                })
-                formatted_results.append({
-                    "ActualMeta": no_canceladas,
-                })
-                formatted_results.append({
-                    "ITC": results[0][2],
-                })
-                formatted_results.append({
-                    "ITD": results[0][3],
-                })
-                formatted_results.append({
-                    "IRS": results[0][4],
-                })
-
-            return formatted_results
+        space_ids, goal = await legacy_zone(None)
+        rows = await reservation_counts()
+        return legacy_statistics(summarize(rows, space_ids, goal))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-
 @router.get("/areasfrecuentesespaciosabiertos")
 async def get_Pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT r.SpaceId, COUNT(*) AS TotalReservations
-            FROM [dbo].[Reservation] r
-            JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-            WHERE r.SpaceId IN (1, 2)
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.Deleted = 0
-            GROUP BY r.SpaceId
-            ORDER BY TotalReservations DESC;
-                        '''
-            results = await db.execute_query(query)
-
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    row[0]: row[1],
-                })
-            return formatted_results
+        space_ids, _ = await legacy_zone("espaciosabiertos")
+        rows = await reservation_counts()
+        return [{space_id: total} for space_id, total in frequent_spaces(rows, space_ids)]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/estadisticasespaciosabiertos")
 async def get_pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT 
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 0 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (1, 2)
-                ) AS NoCanceladas,
-                
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 1 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (1, 2)
-                ) AS Canceladas,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (1, 2)
-                AND u.Carrera = 'ITC'
-                ) AS ITC,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'ITD'
-                AND r.SpaceId IN (1, 2)
-                ) AS ITD,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'IRS'
-                AND r.SpaceId IN (1, 2)
-                ) AS IRS;
-
-                
-            '''
-            results = await db.execute_query(query)
-            no_canceladas = results[0][0]
-            total_reservas = no_canceladas + results[0][1]
-            no_canceladas_porcentaje = round((no_canceladas / total_reservas * 100), 0) if total_reservas > 0 else 0
-            canceladas_porcentaje = round((results[0][1] / total_reservas * 100), 0) if total_reservas > 0 else 0
-            meta_restante = 40 - no_canceladas
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    "NoCanceladasPorcentaje": no_canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "CanceladasPorcentaje": canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "RestanteMeta": meta_restante,
-                })
-                formatted_results.append({
-                    "ActualMeta": no_canceladas,
-                })
-                formatted_results.append({
-                    "ITC": results[0][2],
-                })
-                formatted_results.append({
-                    "ITD": results[0][3],
-                })
-                formatted_results.append({
-                    "IRS": results[0][4],
-                })
-
-            return formatted_results
+        space_ids, goal = await legacy_zone("espaciosabiertos")
+        rows = await reservation_counts()
+        return legacy_statistics(summarize(rows, space_ids, goal))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/areasfrecuentesgaragevalley")
 async def get_Pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT r.SpaceId, COUNT(*) AS TotalReservations
-            FROM [dbo].[Reservation] r
-            JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-            WHERE r.SpaceId IN (3, 4, 5, 6, 7, 8, 9)
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.Deleted = 0
-            GROUP BY r.SpaceId
-            ORDER BY TotalReservations DESC;
-                        '''
-            results = await db.execute_query(query)
-
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    row[0]: row[1],
-                })
-            return formatted_results
+        space_ids, _ = await legacy_zone("garagevalley")
+        rows = await reservation_counts()
+        return [{space_id: total} for space_id, total in frequent_spaces(rows, space_ids)]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/estadisticasgaragevalley")
 async def get_pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT 
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 0 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (3, 4, 5, 6, 7, 8, 9)
-                ) AS NoCanceladas,
-                
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 1 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (3, 4, 5, 6, 7, 8, 9)
-                ) AS Canceladas,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (3, 4, 5, 6, 7, 8, 9)
-                AND u.Carrera = 'ITC'
-                ) AS ITC,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'ITD'
-                AND r.SpaceId IN (3, 4, 5, 6, 7, 8, 9)
-                ) AS ITD,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'IRS'
-                AND r.SpaceId IN (3, 4, 5, 6, 7, 8, 9)
-                ) AS IRS;
-
-                
-            '''
-            results = await db.execute_query(query)
-            no_canceladas = results[0][0]
-            total_reservas = no_canceladas + results[0][1]
-            no_canceladas_porcentaje = round((no_canceladas / total_reservas * 100), 0) if total_reservas > 0 else 0
-            canceladas_porcentaje = round((results[0][1] / total_reservas * 100), 0) if total_reservas > 0 else 0
-            meta_restante = 30 - no_canceladas
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    "NoCanceladasPorcentaje": no_canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "CanceladasPorcentaje": canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "RestanteMeta": meta_restante,
-                })
-                formatted_results.append({
-                    "ActualMeta": no_canceladas,
-                })
-                formatted_results.append({
-                    "ITC": results[0][2],
-                })
-                formatted_results.append({
-                    "ITD": results[0][3],
-                })
-                formatted_results.append({
-                    "IRS": results[0][4],
-                })
-
-            return formatted_results
+        space_ids, goal = await legacy_zone("garagevalley")
+        rows = await reservation_counts()
+        return legacy_statistics(summarize(rows, space_ids, goal))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/areasfrecuentesxploracion")
 async def get_Pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT r.SpaceId, COUNT(*) AS TotalReservations
-            FROM [dbo].[Reservation] r
-            JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-            WHERE r.SpaceId IN (10, 11, 12, 13, 14, 15)
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.Deleted = 0
-            GROUP BY r.SpaceId
-            ORDER BY TotalReservations DESC;
-                        '''
-            results = await db.execute_query(query)
-
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    row[0]: row[1],
-                })
-            return formatted_results
+        space_ids, _ = await legacy_zone("exploracion")
+        rows = await reservation_counts()
+        return [{space_id: total} for space_id, total in frequent_spaces(rows, space_ids)]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/estadisticasexploracion")
 async def get_pending():
     try:
-        async with DB() as db:
-            query = '''
-            SELECT 
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 0 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (10, 11, 12, 13, 14, 15)
-                ) AS NoCanceladas,
-                
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                WHERE r.Deleted = 1 
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (10, 11, 12, 13, 14, 15)
-                ) AS Canceladas,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND r.SpaceId IN (10, 11, 12, 13, 14, 15)
-                AND u.Carrera = 'ITC'
-                ) AS ITC,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'ITD'
-                AND r.SpaceId IN (10, 11, 12, 13, 14, 15)
-                ) AS ITD,
-
-                (SELECT COUNT(*) 
-                FROM [dbo].[Reservation] r
-                JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
-                JOIN [dbo].[User] u ON r.UserId = u.UserId
-                WHERE r.Deleted = 0
-                AND s.Day >= DATEADD(day, -30, GETDATE())
-                AND u.Carrera = 'IRS'
-                AND r.SpaceId IN (10, 11, 12, 13, 14, 15)
-                ) AS IRS;
-
-                
-            '''
-            results = await db.execute_query(query)
-            no_canceladas = results[0][0]
-            total_reservas = no_canceladas + results[0][1]
-            no_canceladas_porcentaje = round((no_canceladas / total_reservas * 100), 0) if total_reservas > 0 else 0
-            canceladas_porcentaje = round((results[0][1] / total_reservas * 100), 0) if total_reservas > 0 else 0
-            meta_restante = 30 - no_canceladas
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    "NoCanceladasPorcentaje": no_canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "CanceladasPorcentaje": canceladas_porcentaje,
-                })
-                formatted_results.append({
-                    "RestanteMeta": meta_restante,
-                })
-                formatted_results.append({
-                    "ActualMeta": no_canceladas,
-                })
-                formatted_results.append({
-                    "ITC": results[0][2],
-                })
-                formatted_results.append({
-                    "ITD": results[0][3],
-                })
-                formatted_results.append({
-                    "IRS": results[0][4],
-                })
-
-            return formatted_results
+        space_ids, goal = await legacy_zone("exploracion")
+        rows = await reservation_counts()
+        return legacy_statistics(summarize(rows, space_ids, goal))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/reservationsexcel")
-async def get_Reservations():
-    try:
-        async with DB() as db:
-            query = '''
+map_export_reservation = row_mapper(
+    ('Day', 2, format_date),
+    ('StartHour', 3, format_time),
+    ('EndHour', 4, format_time),
+    ('SpaceName', 5, str),
+    ('SpaceId', 6),
+    ('GroupCode', 8, str),
+    ('Name', 0, str),
+    ('Matricula', 1, str),
+    ('UserId', 7),
+    ('Fecha', 2),
+    ('Eliminado', 9),
+)
 
-            SELECT [User].[Name], [User].[UserName], [Schedule].[Day], [Schedule].[StartHour], [Schedule].[EndHour], [Space].[Name], [Space].[SpaceId], [User].[UserId], [ReservationGroup].[GroupCode], [Reservation].[Deleted]
-            FROM [dbo].[User]
-            INNER JOIN [dbo].[Reservation]
-                ON [dbo].[User].[UserId] = [dbo].[Reservation].[UserId]
-            INNER JOIN [dbo].[Schedule]
-                ON [dbo].[Reservation].[ScheduleId] = [dbo].[Schedule].[ScheduleId]
-            INNER JOIN [dbo].[Space]
-                ON [dbo].[Reservation].[SpaceId] = [dbo].[Space].[SpaceId]
-            INNER JOIN [dbo].[ReservationGroup]
-                ON [dbo].[Reservation].[GroupId] = [dbo].[ReservationGroup].[GroupId]
-            WHERE 
-                [dbo].[Schedule].[Day] >= DATEADD(day, -30, CAST(GETDATE() AS Date))
+@router.get("/reservationsexcel")
+async def get_Reservations(format: str = "json", start: str = None, end: str = None, zone: str = None):
+    """
+    Exports reservations, by default those of the last 30 days.
 
+    Args:
+        format (str): "json" (default, the whole list in one response), "csv" (streamed in
+            batches as it is read) or "xlsx".
+        start (str, optional): First day to export, 'YYYY-MM-DD'.
+        end (str, optional): Last day to export, 'YYYY-MM-DD'.
+        zone (str, optional): Only export reservations of spaces in this zone.
 
-            '''
-            results = await db.execute_query(query)
+    Raises:
+        HTTPException: 400 for an unknown format or zone, 500 if the export fails.
+    """
+    if format not in ("json", "csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="format must be json, csv or xlsx")
+    if format == "xlsx" and xlsxwriter is None:
+        raise HTTPException(status_code=400, detail="XLSX export requires XlsxWriter to be installed")
+    try:
+        start_day = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end_day = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD")
 
-            
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'Day': f"{row[2]}",
-                    'StartHour': f"{row[3].strftime('%H:%M')}",
-                    'EndHour': f"{row[4].strftime('%H:%M')}",
-                    "SpaceName": f"{row[5]}",
-                    "SpaceId": row[6],
-                    "GroupCode": f"{row[8]}",
-                    'Name': f"{row[0]}",
-                    'Matricula': f"{row[1]}",
-                    'UserId': row[7],
-                    'Fecha': row[2],
-                    'Eliminado': row[9]
-                })
-            return formatted_results
+    try:
+        zone_id = None
+        if zone is not None:
+            found = await catalog.zone_by_name(zone)
+            if found is None:
+                raise HTTPException(status_code=400, detail="Zone not found")
+            zone_id = found.zone_id
+        query, params = reservations_export_query(start_day, end_day, zone_id)
+
+        if format == "csv":
+            return StreamingResponse(
+                stream_csv(query, params),
+                media_type="text/csv; charset=utf-8",
+                headers={"Content-Disposition": 'attachment; filename="reservaciones.csv"'},
+            )
+        if format == "xlsx":
+            return StreamingResponse(
+                stream_xlsx(query, params),
+                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                headers={"Content-Disposition": 'attachment; filename="reservaciones.xlsx"'},
+            )
+
+        async with DB(read_only=True) as db:
+            results = await db.execute_query(query, params)
+
+            return json_response([map_export_reservation(row) for row in results])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/infotablas")
-async def get_pending():
+async def get_pending(response: Response, limit: int = None, cursor: str = None):
+    """
+    Rows of the User table ordered by UserId, one page at a time.
+    The cursor of the next page is returned in the X-Next-Cursor header; without `limit`
+    and `cursor` the whole table is returned at once.
+    """
+    page_size = page_limit(limit, cursor)
+    after = decode_cursor(cursor, int)
     try:
-        async with DB() as db:
+        async with DB(read_only=True) as db:
             query = '''
-            SELECT * FROM [dbo].[User]
+            SELECT {top} * FROM [dbo].[User] WHERE [UserId] > ? ORDER BY [UserId]
             '''
-            results = await db.execute_query(query)
+            top_clause, params = top(page_size)
+            query = query.format(top=top_clause)
+            params.append(after[0] if after else 0)
+            results = await db.execute_query(query, params)
             
             # Si results es una lista de tuplas, se necesita acceder a los nombres de las columnas desde el primer resultado
             if results:
@@ -703,9 +428,11 @@ async def get_pending():
                 SELECT COLUMN_NAME 
                 FROM INFORMATION_SCHEMA.COLUMNS 
                 WHERE TABLE_NAME = 'User'
+                ORDER BY ORDINAL_POSITION
                 '''
                 columns_result = await db.execute_query(columns_query)
                 columns = [column[0] for column in columns_result]
+                results = paginate(response, results, page_size, lambda row: (row[columns.index('UserId')],))
 
                 # Convertir los resultados a una lista de diccionarios
                 formatted_results = [dict(zip(columns, row)) for row in results]
@@ -720,7 +447,14 @@ async def get_pending():
 @router.get("/available-spaces")
 async def get_available_spaces():
     try:
-        async with DB() as db:
+        if availability.ready:
+            now = datetime.now()
+            return [
+                {'SpaceId': space_id, 'Reservations': int(occupied)}
+                for space_id, occupied in availability.hour_status(now.date(), now.hour)
+            ]
+
+        async with DB(read_only=True) as db:
             sql = "EXEC GetReservationsForCurrentHour"
             results = await db.execute_query(sql)
             formatted_results = []
@@ -733,4 +467,50 @@ async def get_available_spaces():
             return formatted_results
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+
+@router.post("/catalog/invalidate")
+async def invalidate_catalog():
+    """
+    Drops the cached Space, Zone and requirement catalog so the next read reloads it.
+    Call after editing those tables.
+    """
+    catalog.invalidate()
+    return {"message": "Catalog invalidated"}
+
+
+@router.get("/slow-queries")
+async def slow_queries(limit: int = Query(20, ge=1, le=200)):
+    """
+    Where the database time goes: the most expensive statement fingerprints of the rolling
+    window and the latest statements above SLOW_QUERY_MS.
+
+    Args:
+        limit (int): How many fingerprints to return.
+
+    Returns:
+        dict: {"threshold_ms", "top": [...], "recent": [...]}.
+    """
+    return {
+        "threshold_ms": query_log.threshold * 1000,
+        "top": query_log.summary(limit),
+        "recent": list(query_log.slow)[::-1],
+    }
+
+
+@router.post("/rollup/rebuild")
+async def rebuild_reservation_rollup(since: str = None):
+    """
+    Recomputes dbo.DailyReservationRollup from the raw reservations.
+
+    Args:
+        since (str, optional): Only rebuild days from this date ('YYYY-MM-DD') on.
+
+    Returns:
+        dict: The number of rollup rows written.
+    """
+    try:
+        rows = await rebuild_rollup(datetime.strptime(since, '%Y-%m-%d').date() if since else None)
+        return {"message": "Rollup rebuilt", "rows": rows}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
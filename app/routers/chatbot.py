@@ -3,8 +3,13 @@ from app.models import Reservation, DeleteReservation, ReservationBot
 from app.db import DB
 from app.dependencies import check_api_key
 from uuid import uuid4
-from app.functions import get_requirements_query
-from datetime import datetime, timedelta
+from app.functions import get_requirements_query, cancel_reservation_group
+from datetime import datetime, timedelta, time
+from app.availability import availability
+from app.catalog import catalog
+from app.versions import versions
+from app.write_behind import insert_pending_reservation
+from app.formatting import row_mapper, format_date, format_time, json_response
 
 router = APIRouter(
     prefix="/chatbot",
@@ -58,20 +63,10 @@ async def get_Zones():
         - HTTPException: If there is an error while executing the query.
     """
     try:
-        async with DB() as db:
-            query = '''
-                SELECT [ZoneName], [Description] 
-                FROM [dbo].[Zone];
-            '''
-            results = await db.execute_query(query)
-
-            # Format results
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'Zone': f"{row[0]}: {row[1]}"
-                })
-            return formatted_results
+        return [
+            {'Zone': f"{zone.zone_name}: {zone.description}"}
+            for zone in await catalog.zones()
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -90,39 +85,18 @@ async def get_spaces_by_zone(zone_name: str):
         - HTTPException: If the zone is not found or there is an error while executing the query.
     """
     try:
-        async with DB() as db:
-            # First, get the ZoneId for the given zone name
-            query = '''
-                SELECT [ZoneId]
-                FROM [dbo].[Zone]
-                WHERE ZoneName = ?;
-            '''
-            params = (zone_name,)
-            zone = await db.execute_query(query, params)
-
-            if not zone:
-                raise HTTPException(status_code=404, detail="Zone not found")
-
-            zone_id = zone[0][0]
-
-            # Then, get all spaces for that ZoneId
-            query = '''
-                SELECT [SpaceId], [Name], [Description]
-                FROM [dbo].[Space]
-                WHERE ZoneId = ?;
-            '''
-            params = (zone_id,)
-            results = await db.execute_query(query, params)
-
-            # Format results
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'SpaceId': row[0],
-                    'Name': row[1],
-                    'Description': row[2]
-                })
-            return formatted_results
+        zone = await catalog.zone_by_name(zone_name)
+        if zone is None:
+            raise HTTPException(status_code=404, detail="Zone not found")
+
+        return [
+            {
+                'SpaceId': space.space_id,
+                'Name': space.name,
+                'Description': space.description
+            }
+            for space in await catalog.spaces_in_zone(zone.zone_id)
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -141,24 +115,14 @@ async def get_space_description(SpaceName: str):
         - HTTPException: If there is an error while executing the query.
     """
     try:
-        async with DB() as db:
-            query = '''
-                SELECT [SpaceId], [Name], [Description]
-                FROM [dbo].[Space]
-                WHERE LOWER(Name) = LOWER(?);
-            '''
-            params = (SpaceName,)
-            results = await db.execute_query(query, params)
-
-            # Format results
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'SpaceId': row[0],
-                    'Name': row[1],
-                    'Description': row[2]
-                })
-            return formatted_results
+        space = await catalog.space_by_name(SpaceName)
+        if space is None:
+            return []
+        return [{
+            'SpaceId': space.space_id,
+            'Name': space.name,
+            'Description': space.description
+        }]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -189,7 +153,13 @@ async def get_schedule(SpaceId: int, Day: str):
     date = today + timedelta(days=days_count)
     final_day = date.strftime('%Y-%m-%d')
     try:
-        async with DB() as db:
+        if availability.ready:
+            return [
+                {'StartHour': start_hour, 'EndHour': end_hour}
+                for _, start_hour, end_hour in availability.free_slots(SpaceId, date.date())
+            ]
+
+        async with DB(read_only=True) as db:
             query = '''
                 SELECT [StartHour], [EndHour]
                 FROM [dbo].[Schedule] 
@@ -223,7 +193,13 @@ async def get_schedule_by_hour(SpaceId: int, Day: str, Hour: str):
     date = today + timedelta(days=days_count)
     final_day = date.strftime('%Y-%m-%d')
     try:
-        async with DB() as db:
+        if availability.ready:
+            slot = availability.free_slot(SpaceId, date.date(), time.fromisoformat(Hour).hour)
+            if slot is None:
+                return {"message": "Horario no disponible"}
+            return [{'StartHour': slot[1], 'EndHour': slot[2]}]
+
+        async with DB(read_only=True) as db:
             query = '''
                 SELECT [StartHour], [EndHour]
                 FROM [dbo].[Schedule] 
@@ -262,25 +238,15 @@ async def get_space_requirements(SpaceId: int):
         - HTTPException: If there is an error while executing the query.
     """
     try:
-        async with DB() as db:
-            query = "EXEC GetSpaceRequirements @SpaceId = ?"
-            params = (SpaceId,)
-            results = await db.execute_query(query, params)
-            formatted_results = []
-
-            for row in results:
-                requirement_id = row[1]
-                requirement_name = row[2]
-                max_quantity = row[3]
-
-                formatted_results.append({
-                    'SpaceId': row[0],
-                    'RequirementId': requirement_id,
-                    'RequirementName': requirement_name,
-                    'MaxQuantity': max_quantity
-                })
-
-            return formatted_results
+        return [
+            {
+                'SpaceId': requirement.space_id,
+                'RequirementId': requirement.requirement_id,
+                'RequirementName': requirement.requirement_name,
+                'MaxQuantity': requirement.max_quantity
+            }
+            for requirement in await catalog.requirements(SpaceId)
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -299,11 +265,9 @@ async def create_reservation(res: Reservation):
         - HTTPException: If there is an error while executing the query.
     """
     try:
-        async with DB() as db:
-            query = "INSERT INTO [dbo].[PendingReservation] (UserId, SpaceId, ScheduleId, UserRequirements) VALUES (?, ?, ?, ?);"
-            params = (res.user_id, res.space_id, res.schedule_id, res.user_requirements)
-            results = await db.execute_query_insert(query, params)
-            return {"message": "Reservation created successfully"}
+        await insert_pending_reservation(res.user_id, res.space_id, res.schedule_id, res.user_requirements)
+        versions.bump_user(res.user_id)
+        return {"message": "Reservation created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -354,17 +318,32 @@ async def create_reservation_bot(res: ReservationBot):
     print("Resultado:", result)
 
     try:
-        async with DB() as db:
-            query = "SELECT [ScheduleId] from dbo.Schedule WHERE [Day] = ? AND [StartHour] = ? AND [SpaceId] = ? AND [Occupied] = 0;"
-            params = (dates[0], dates[1], res.space_id)
-            results = await db.execute_query(query, params)
-            if len(results) == 0:
+        if availability.ready:
+            schedule_id = availability.find_free_schedule(res.space_id, dates[0], dates[1])
+            if schedule_id is None:
                 raise HTTPException(status_code=404, detail="Schedule not found or already occupied")
-            schedule_id = results[0][0]
-            return await create_reservation(Reservation(user_id=res.user_id, space_id=res.space_id, schedule_id=int(schedule_id), user_requirements=result))
+        else:
+            async with DB() as db:
+                query = "SELECT [ScheduleId] from dbo.Schedule WHERE [Day] = ? AND [StartHour] = ? AND [SpaceId] = ? AND [Occupied] = 0;"
+                params = (dates[0], dates[1], res.space_id)
+                results = await db.execute_query(query, params)
+                if len(results) == 0:
+                    raise HTTPException(status_code=404, detail="Schedule not found or already occupied")
+                schedule_id = results[0][0]
+        return await create_reservation(Reservation(user_id=res.user_id, space_id=res.space_id, schedule_id=int(schedule_id), user_requirements=result))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+map_reservation_details = row_mapper(
+    ('Day', 0, format_date),
+    ('StartHour', 1, format_time),
+    ('EndHour', 2, format_time),
+    ('SpaceName', 3),
+    ('SpaceId', 4),
+    ('UserRequirements', 5),
+    ('GroupCode', 6),
+)
+
 # Get reservations for a specific user
 @router.get("/{user_id}")
 async def get_reservations(user_id: int):
@@ -386,22 +365,11 @@ async def get_reservations(user_id: int):
             - 'GroupCode': The group code associated with the reservation.
     """
     try:
-        async with DB() as db:
+        async with DB(read_only=True, user_id=user_id) as db:
             query = "EXEC GetReservationDetails @UserId = ?"
             params = (user_id,)
             results = await db.execute_query(query, params)
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'Day': row[0].strftime('%Y-%m-%d'),
-                    'StartHour': row[1].strftime('%H:%M'),
-                    'EndHour': row[2].strftime('%H:%M'),
-                    'SpaceName': row[3],
-                    'SpaceId': row[4],
-                    'UserRequirements': row[5],
-                    'GroupCode': row[6]
-                })
-            return formatted_results
+            return json_response([map_reservation_details(row) for row in results])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -422,16 +390,7 @@ async def delete_reservation(body: DeleteReservation):
     """
     try:
         print(body)
-        async with DB() as db:
-            query = """
-                DECLARE @GroupId INT
- 
-                SELECT @GroupId = GroupId FROM ReservationGroup where GroupCode = ?
-
-                UPDATE [dbo].[Reservation] SET Deleted = 1 WHERE GroupId = @GroupId;
-                """
-            params = (body.group_code)
-            results = await db.execute_query_insert(query, params)
-            return {"message": "Reservation deleted successfully"}
+        results = await cancel_reservation_group(body.group_code)
+        return {"message": "Reservation deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,17 +1,21 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from app.models import User
 from app.db import DB
+from app.passwords import passwords
+from app.tags import tag_index
 import os
 from jose import jwt
 from dotenv import load_dotenv
 from app.dependencies import check_api_key
-import bcrypt
 import time
+import asyncio
 from pydantic import BaseModel
 
 load_dotenv()
 
-login_variable = False
+LOGIN_WAIT_TIMEOUT = float(os.getenv("LOGIN_WAIT_TIMEOUT", "60"))
+LOGIN_LATCH_SECONDS = float(os.getenv("LOGIN_LATCH_SECONDS", "30"))
+DEFAULT_DEVICE = "default"
 
 router = APIRouter(
     prefix="/login",
@@ -38,18 +42,24 @@ async def login(user: User):
             query = "EXEC SearchUser @p_Username = ?;"
             params = (user.username)
             results = await db.execute_query(query, params)
-            if bcrypt.checkpw(user.password.encode('utf-8'), results[0][2].encode('utf-8')):
-                token = jwt.encode({
-                    "username": user.username, 
-                    "userId": results[0][0],
-                    "name": results[0][3],
-                    "role": results[0][4],
-                    "priority": results[0][5],
-                    "profile picture": results[0][6],
-                }, os.getenv('JWT_SECRET'), algorithm='HS256')
-                return {"token": token}
-            else:
-                raise HTTPException(status_code=401, detail="Unauthorized") 
+        # bcrypt runs with the connection back in the pool, a login storm must not starve every other endpoint
+        if await passwords.verify(user.password, results[0][2]):
+            if passwords.needs_rehash(results[0][2]):
+                # The work factor changed since this hash was stored, upgrade it while we have the password
+                rehashed = await passwords.hash(user.password)
+                async with DB() as db:
+                    await db.execute_query_insert("UPDATE [dbo].[User] SET Password = ? WHERE UserId = ?;", (rehashed, results[0][0]))
+            token = jwt.encode({
+                "username": user.username, 
+                "userId": results[0][0],
+                "name": results[0][3],
+                "role": results[0][4],
+                "priority": results[0][5],
+                "profile picture": results[0][6],
+            }, os.getenv('JWT_SECRET'), algorithm='HS256')
+            return {"token": token}
+        else:
+            raise HTTPException(status_code=401, detail="Unauthorized") 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -103,30 +113,106 @@ async def create_user(user: User):
         HTTPException: If there is an error while creating the user.
     """
     try: 
+        hashed_password = await passwords.hash(user.password)
+
         async with DB() as db:
-            hashed_password = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())
-            
             query = "INSERT INTO [dbo].[User] (Username, Password, Name, RoleId, Priority, ProfilePicture, TagId, PatternPassword) VALUES (?, ?, ?, ?, ?, ?, ?, ?);"
             params = (user.username, hashed_password, user.name, user.role_id, user.priority, user.profile_picture, user.tag_id, user.pattern_password)
             results = await db.execute_query_insert(query=query, params=params)
-            
-            return {"message": "User created successfully", "results": results}
+        # Only once the connection is back in the pool: refresh_tag checks out one of its own
+        if results:
+            await tag_index.refresh_tag(user.tag_id)
+
+        return {"message": "User created successfully", "results": results}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+class LoginWaiters:
+    """
+    Kiosks waiting for a badge tap, keyed by device id.
+
+    `notify` resolves every waiter of that device at once. A tap that arrives while nobody is
+    waiting is kept for LOGIN_LATCH_SECONDS so a kiosk that polls right after still logs in.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._latched = {}
+
+    async def wait(self, device_id, timeout):
+        expires_at, user_id = self._latched.pop(device_id, (0, None))
+        if expires_at > time.monotonic():
+            return user_id
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(device_id, set()).add(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self._waiters.get(device_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self._waiters[device_id]
+
+    def notify(self, device_id, user_id):
+        waiters = [future for future in self._waiters.pop(device_id, set()) if not future.done()]
+        if not waiters:
+            self._latched[device_id] = (time.monotonic() + LOGIN_LATCH_SECONDS, user_id)
+        for future in waiters:
+            future.set_result(user_id)
+        return len(waiters)
+
+
+login_waiters = LoginWaiters()
+
+
+async def wait_for_disconnect(request: Request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
 @router.get("/id")
-def id_login():
-    global login_variable
-    print("Waiting for login")
-    while login_variable == False:
-        time.sleep(1)
-    login_variable = False
-    return {"message": "Logged in"}
+async def id_login(request: Request, device_id: str = DEFAULT_DEVICE, timeout: float = None):
+    """
+    Long-polls until a badge is tapped on the IoT reader paired with `device_id`.
+
+    Args:
+        device_id (str): The kiosk/reader identifier, shared with POST /login/id/iot.
+        timeout (float, optional): Seconds to wait, capped at LOGIN_WAIT_TIMEOUT.
+
+    Returns:
+        dict: {"message": "Logged in", "UserId": ...} once the tag is accepted.
+
+    Raises:
+        HTTPException: 408 if no badge is tapped before the timeout.
+    """
+    timeout = min(timeout or LOGIN_WAIT_TIMEOUT, LOGIN_WAIT_TIMEOUT)
+    wait = asyncio.ensure_future(login_waiters.wait(device_id, timeout))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({wait, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Cancelling the wait also unregisters it, so a kiosk that went away never swallows a tap
+        for task in (wait, disconnect):
+            if not task.done():
+                task.cancel()
+
+    if not wait.done() or wait.cancelled():
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    try:
+        user_id = wait.result()
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=408, detail="No badge was tapped")
+    return {"message": "Logged in", "UserId": user_id}
 
 
 class TagId(BaseModel):
     TagId: str
+    DeviceId: str = DEFAULT_DEVICE
 
 @router.post("/id/iot")
 async def id_login_iot(body: TagId):
@@ -134,7 +220,7 @@ async def id_login_iot(body: TagId):
     Endpoint for logging in with an IoT device using a TagId.
 
     Args:
-        body (TagId): The TagId of the user.
+        body (TagId): The TagId of the user and the DeviceId of the reader it was tapped on.
 
     Returns:
         dict: A dictionary with the message "Logged in" if the login is successful.
@@ -142,12 +228,9 @@ async def id_login_iot(body: TagId):
     Raises:
         HTTPException: If the login is unsuccessful, an HTTPException with status code 401 (Unauthorized) is raised.
     """
-    global login_variable
-    async with DB() as db:
-        query = f"SELECT * FROM [User] WHERE TagId = '{body.TagId}'"
-        results = await db.execute_query(query)
-        if len(results) > 0:
-            login_variable = True
-            return {"message": "Logged in"}
-        else:
-            raise HTTPException(status_code=401, detail="Unauthorized")
+    user_id = await tag_index.user_id(body.TagId)
+    if user_id is not None:
+        login_waiters.notify(body.DeviceId, user_id)
+        return {"message": "Logged in"}
+    else:
+        raise HTTPException(status_code=401, detail="Unauthorized")
@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response
 from app.models import Reservation, DeleteReservation, ReservationBot
 from app.db import DB
 from app.dependencies import check_api_key
-from app.functions import create_confirmed_reservation
+from app.functions import cancel_reservation_group, instant_book, INSTANT_BOOK_SPACE_IDS
+from app.availability import availability
+from datetime import datetime, date
+from app.write_behind import insert_pending_reservation
+from app.pagination import page_limit, decode_cursor, paginate, top
+from app.versions import versions, not_modified
+from app.formatting import row_mapper, format_date, format_time, json_response
 
 router = APIRouter(
     prefix="/reservations",
@@ -10,8 +16,33 @@ router = APIRouter(
     dependencies=[Depends(check_api_key)]
 )
 
+map_schedule = row_mapper(
+    ('ScheduleId', 0),
+    ('Day', 1, format_date),
+    ('StartHour', 2, format_time),
+    ('EndHour', 3, format_time),
+)
+
+map_reservation_details = row_mapper(
+    ('Day', 0, format_date),
+    ('StartHour', 1, format_time),
+    ('EndHour', 2, format_time),
+    ('SpaceName', 3),
+    ('SpaceId', 4),
+    ('UserRequirements', 5),
+    ('GroupCode', 6),
+)
+
+map_pending_reservation = row_mapper(
+    ('PendingReservationId', 0),
+    ('SpaceId', 1),
+    ('Day', 2, format_date),
+    ('StartHour', 3, format_time),
+    ('EndHour', 4, format_time),
+)
+
 @router.get("/schedule/{area_id}")
-async def get_Schedule(area_id: int):
+async def get_Schedule(area_id: int, request: Request, response: Response):
     """
     Retrieves the schedule for a specific area.
 
@@ -28,22 +59,31 @@ async def get_Schedule(area_id: int):
     Raises:
     - HTTPException: If there is an error retrieving the schedule, a 500 status code with the error message is raised.
     """
+    cached = not_modified(request, response, versions.space_etag(area_id))
+    if cached:
+        return cached
     try:
-        async with DB() as db:
+        if availability.ready:
+            now = datetime.now()
+            formatted_results = []
+            for day in availability.days(area_id, now.date()):
+                from_hour = now.hour + 1 if day == now.date() else 0
+                for schedule_id, start_hour, end_hour in availability.free_slots(area_id, day, from_hour):
+                    formatted_results.append({
+                        'ScheduleId': schedule_id,
+                        'Day': format_date(day),
+                        'StartHour': format_time(start_hour),
+                        'EndHour': format_time(end_hour),
+                    })
+            return json_response(formatted_results, response)
+
+        async with DB(read_only=True) as db:
             query = "EXEC GetSchedule @p_SpaceId = ?"
             params = (area_id,)
             results = await db.execute_query(query, params)
 
             # Format results
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'ScheduleId': row[0],
-                    'Day': row[1].strftime('%Y-%m-%d'),
-                    'StartHour': row[2].strftime('%H:%M'),
-                    'EndHour': row[3].strftime('%H:%M'),
-                })
-            return formatted_results
+            return json_response([map_schedule(row) for row in results], response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -62,15 +102,40 @@ async def create_reservation(res: Reservation):
         HTTPException: If an error occurs while creating the reservation.
     """
     try:
-        async with DB() as db:
-            query = "INSERT INTO [dbo].[PendingReservation] (UserId, SpaceId, ScheduleId, UserRequirements) VALUES (?, ?, ?, ?);"
-            params = (res.user_id, res.space_id, res.schedule_id, res.user_requirements)
-            results = await db.execute_query_insert(query, params)
-            return {"message": "Reservation created successfully"}
+        await insert_pending_reservation(res.user_id, res.space_id, res.schedule_id, res.user_requirements)
+        versions.bump_user(res.user_id)
+        return {"message": "Reservation created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
    
     
+@router.post("/instant")
+async def create_instant_reservation(res: Reservation):
+    """
+    Books a slot immediately in a space listed in INSTANT_BOOK_SPACE_IDS, skipping the
+    pending/priority allocation.
+
+    Args:
+        res (Reservation): The reservation to confirm.
+
+    Returns:
+        dict: {"message": "Reservation confirmed", "GroupCode": ...}.
+
+    Raises:
+        HTTPException: 400 if the space does not allow instant booking, 409 if the slot is
+        already taken and 500 on database errors.
+    """
+    if res.space_id not in INSTANT_BOOK_SPACE_IDS:
+        raise HTTPException(status_code=400, detail="This space does not allow instant booking")
+    try:
+        group_code = await instant_book(res)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if group_code is None:
+        raise HTTPException(status_code=409, detail="Schedule not found or already occupied")
+    return {"message": "Reservation confirmed", "GroupCode": group_code}
+
+
 @router.post("/create/bot")
 async def create_reservation_bot(res: ReservationBot):
     """
@@ -87,20 +152,25 @@ async def create_reservation_bot(res: ReservationBot):
     """
     dates = res.schedule.split(" ")
     try:
-        async with DB() as db:
-            query = "SELECT [ScheduleId] from dbo.Schedule WHERE [Day] = ? AND [StartHour] = ? AND [SpaceId] = ? AND [Occupied] = 0;"
-            params = (dates[0], dates[1], res.space_id)
-            results = await db.execute_query(query, params)
-            if len(results) == 0:
+        if availability.ready:
+            schedule_id = availability.find_free_schedule(res.space_id, dates[0], dates[1])
+            if schedule_id is None:
                 raise HTTPException(status_code=404, detail="Schedule not found or already occupied")
-            schedule_id = results[0][0]
-            return await create_reservation(Reservation(user_id=res.user_id, space_id=res.space_id, schedule_id=int(schedule_id), user_requirements=res.user_requirements))
+        else:
+            async with DB() as db:
+                query = "SELECT [ScheduleId] from dbo.Schedule WHERE [Day] = ? AND [StartHour] = ? AND [SpaceId] = ? AND [Occupied] = 0;"
+                params = (dates[0], dates[1], res.space_id)
+                results = await db.execute_query(query, params)
+                if len(results) == 0:
+                    raise HTTPException(status_code=404, detail="Schedule not found or already occupied")
+                schedule_id = results[0][0]
+        return await create_reservation(Reservation(user_id=res.user_id, space_id=res.space_id, schedule_id=int(schedule_id), user_requirements=res.user_requirements))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Get reservations for a specific user
 @router.get("/{user_id}")
-async def get_reservations(user_id: int):
+async def get_reservations(user_id: int, request: Request, response: Response):
     """
     Retrieves reservation details for a given user.
 
@@ -118,28 +188,20 @@ async def get_reservations(user_id: int):
             - 'RequirementsQuantity': The quantity of the reservation requirements.
             - 'GroupCode': The group code associated with the reservation.
     """
+    cached = not_modified(request, response, versions.user_etag(user_id))
+    if cached:
+        return cached
     try:
-        async with DB() as db:
+        async with DB(read_only=True, user_id=user_id) as db:
             query = "EXEC GetReservationDetails @UserId = ?"
             params = (user_id,)
             results = await db.execute_query(query, params)
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'Day': row[0].strftime('%Y-%m-%d'),
-                    'StartHour': row[1].strftime('%H:%M'),
-                    'EndHour': row[2].strftime('%H:%M'),
-                    'SpaceName': row[3],
-                    'SpaceId': row[4],
-                    'UserRequirements': row[5],
-                    'GroupCode': row[6]
-                })
-            return formatted_results
+            return json_response([map_reservation_details(row) for row in results], response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.get("/pending/{user_id}")
-async def get_pending_reservations(user_id: int):
+async def get_pending_reservations(user_id: int, request: Request, response: Response):
     """
     Retrieves the pending reservations for a specific user.
 
@@ -158,21 +220,15 @@ async def get_pending_reservations(user_id: int):
     Raises:
     - HTTPException: If an error occurs while retrieving the pending reservations.
     """
+    cached = not_modified(request, response, versions.user_etag(user_id))
+    if cached:
+        return cached
     try:
-        async with DB() as db:
+        async with DB(read_only=True, user_id=user_id) as db:
             query = "EXEC GetPendingReservations @UserId = ?"
             params = (user_id,)
             results = await db.execute_query(query, params)
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'PendingReservationId': row[0],
-                    'SpaceId': row[1],
-                    'Day': row[2].strftime('%Y-%m-%d'),
-                    'StartHour': row[3].strftime('%H:%M'),
-                    'EndHour': row[4].strftime('%H:%M'),
-                })
-            return formatted_results
+            return json_response([map_pending_reservation(row) for row in results], response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -193,34 +249,34 @@ async def delete_reservation(body: DeleteReservation, reservation_type: str = He
     - HTTPException: If an error occurs during the deletion process.
     """
     try:
-        async with DB() as db:
-            print(reservation_type)
-            if reservation_type == "pending":
+        print(reservation_type)
+        if reservation_type == "pending":
+            async with DB() as db:
                 query = "UPDATE [dbo].[PendingReservation] SET Deleted = 1 WHERE [PendingReservationId] = ? AND [UserId] = ?;"
                 params = (body.reservation_id, body.user_id)
                 results = await db.execute_query_insert(query, params)
+                versions.bump_user(body.user_id)
                 return {"message": "Reservation deleted successfully"}
-            else:
-                query = """
-                DECLARE @GroupId INT
-
-                SELECT @GroupId = GroupId FROM ReservationGroup where GroupCode = ?
-
-                UPDATE [dbo].[Reservation] SET Deleted = 1 WHERE GroupId = @GroupId;
-                """
-                params = (body.group_code,)
-                results = await db.execute_query_insert(query, params)
-                return {"message": "Reservation deleted successfully"}
+        else:
+            results = await cancel_reservation_group(body.group_code)
+            return {"message": "Reservation deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.get("/historial/{user_id}")
-async def get_past_reservations(user_id: int):
+async def get_past_reservations(user_id: int, response: Response, limit: int = None, cursor: str = None):
+    """
+    Past reservations of a user, most recent first, one page at a time.
+    The cursor of the next page is returned in the X-Next-Cursor header; without `limit`
+    and `cursor` the whole history is returned at once.
+    """
+    page_size = page_limit(limit, cursor)
+    before = decode_cursor(cursor, date.fromisoformat, int, int)
     try:
-        async with DB() as db:
+        async with DB(read_only=True, user_id=user_id) as db:
             query = """
-                SELECT 
-                    s.Day, s.StartHour, s.EndHour, sp.Name AS SpaceName, sp.SpaceId, r.UserRequirements, rg.GroupCode
+                SELECT {top}
+                    s.Day, s.StartHour, s.EndHour, sp.Name AS SpaceName, sp.SpaceId, r.UserRequirements, rg.GroupCode, r.ScheduleId, r.GroupId
                 FROM 
                     dbo.Reservation r
                 JOIN 
@@ -231,22 +287,18 @@ async def get_past_reservations(user_id: int):
                     dbo.Schedule s ON r.ScheduleId = s.ScheduleId
                 WHERE 
                     r.UserId = ? AND s.Day < GETDATE() AND r.Deleted = 0
+                    {before}
                 ORDER BY 
-                    s.Day DESC;
+                    s.Day DESC, r.ScheduleId DESC, r.GroupId DESC;
             """
-            params = (user_id,)
-            results = await db.execute_query(query, params)
-            formatted_results = []
-            for row in results:
-                formatted_results.append({
-                    'Day': row[0].strftime('%Y-%m-%d'),
-                    'StartHour': row[1].strftime('%H:%M'),
-                    'EndHour': row[2].strftime('%H:%M'),
-                    'SpaceName': row[3],
-                    'SpaceId': row[4],
-                    'UserRequirements': row[5],
-                    'GroupCode': row[6]
-                })
-            return formatted_results
+            top_clause, params = top(page_size)
+            params.append(user_id)
+            if before:
+                query = query.format(top=top_clause, before="AND (s.Day < ? OR (s.Day = ? AND (r.ScheduleId < ? OR (r.ScheduleId = ? AND r.GroupId < ?))))")
+                params += [before[0], before[0], before[1], before[1], before[2]]
+            else:
+                query = query.format(top=top_clause, before="")
+            results = paginate(response, await db.execute_query(query, params), page_size, lambda row: (row[0], row[7], row[8]))
+            return json_response([map_reservation_details(row) for row in results], response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
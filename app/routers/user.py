@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from app.models import Statistic
 from app.db import DB
 from app.dependencies import check_api_key
 from uuid import uuid4
 from app.functions import get_requirements_query
 from datetime import datetime, timedelta
+from app.versions import versions, not_modified
 
 router = APIRouter(
     prefix="/user",
@@ -13,7 +14,7 @@ router = APIRouter(
 )
 
 @router.get("/statistics/{UserId}")
-async def get_statistics(UserId: int):
+async def get_statistics(UserId: int, request: Request, response: Response):
     """
     Retrieve statistics for a specific user.
 
@@ -29,8 +30,11 @@ async def get_statistics(UserId: int):
     Raises:
         HTTPException: If there is an error retrieving the statistics from the database.
     """
+    cached = not_modified(request, response, versions.user_etag(UserId))
+    if cached:
+        return cached
     try:
-        async with DB() as db:
+        async with DB(read_only=True, user_id=UserId) as db:
             query = '''
                 SELECT [Reservations], [StudyHours], [ExploredAreas]
                 FROM [dbo].[Statistic]
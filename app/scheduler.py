@@ -0,0 +1,108 @@
+import os
+import socket
+import datetime
+from contextlib import asynccontextmanager
+import orjson
+from app.db import DB
+
+DAILY_JOB_HOUR = int(os.getenv("DAILY_JOB_HOUR", "6"))
+DAILY_JOB_CRON = f"0 {DAILY_JOB_HOUR} * * *"
+HOST = f"{socket.gethostname()}:{os.getpid()}"
+
+# Session-owned application lock: it is held for as long as the connection that took it, so a
+# worker that dies mid-run releases it with its connection and another worker can take over.
+JOB_LOCK_QUERY = """
+    SET NOCOUNT ON;
+    DECLARE @result INT;
+    EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = 0;
+    SELECT @result;
+"""
+
+JOB_UNLOCK_QUERY = """
+    SET NOCOUNT ON;
+    DECLARE @result INT;
+    EXEC @result = sp_releaseapplock @Resource = ?, @LockOwner = 'Session';
+    SELECT @result;
+"""
+
+# Claims (JobName, Tick) unless it already succeeded; returns the JobRunId only when this
+# caller should run the job.
+CLAIM_RUN_QUERY = """
+    SET NOCOUNT ON;
+    MERGE [dbo].[JobRun] WITH (HOLDLOCK) AS target
+    USING (SELECT ? AS JobName, ? AS Tick) AS source
+    ON target.JobName = source.JobName AND target.Tick = source.Tick
+    WHEN MATCHED AND target.Status <> 'succeeded' THEN
+        UPDATE SET Status = 'running', Attempts = target.Attempts + 1, StartedAt = SYSUTCDATETIME(), FinishedAt = NULL, Host = ?
+    WHEN NOT MATCHED THEN
+        INSERT (JobName, Tick, Status, Attempts, StartedAt, Host) VALUES (source.JobName, source.Tick, 'running', 1, SYSUTCDATETIME(), ?)
+    OUTPUT inserted.JobRunId;
+"""
+
+FINISH_RUN_QUERY = "UPDATE [dbo].[JobRun] SET Status = ?, FinishedAt = SYSUTCDATETIME(), Summary = ? WHERE JobRunId = ?;"
+
+
+def daily_tick(now=None, hour=DAILY_JOB_HOUR):
+    """
+    The most recent DAILY_JOB_HOUR:00 at or before `now`: the tick a daily job run belongs to.
+    """
+    now = now or datetime.datetime.now()
+    tick = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    return tick if tick <= now else tick - datetime.timedelta(days=1)
+
+
+def _claim(cursor, name, tick):
+    row = cursor.execute(CLAIM_RUN_QUERY, (name, tick, HOST, HOST)).fetchone()
+    return row[0] if row else None
+
+
+@asynccontextmanager
+async def job_lease(name):
+    """
+    Holds the sp_getapplock lease of job `name` for the duration of the block. Yields False,
+    without waiting, when another process already holds it.
+    """
+    async with DB() as lock_db:
+        rows = await lock_db.execute_query(JOB_LOCK_QUERY, (f"job:{name}",))
+        if not rows:
+            raise Exception(f"Could not take the {name} job lock")
+        if rows[0][0] < 0:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            released = await lock_db.execute_query(JOB_UNLOCK_QUERY, (f"job:{name}",))
+            if not released or released[0][0] < 0:
+                # Never hand a connection that still holds the lease back to the pool
+                lock_db.broken = True
+
+
+async def run_job(name, tick, job):
+    """
+    Runs `await job()` for (name, tick) in exactly one process across all workers.
+
+    The job runs under an sp_getapplock lease and is recorded in dbo.JobRun; a tick that
+    already succeeded is skipped, a failed one is run again by the next caller. Returns the
+    job's result, or None when another process holds the lease or the tick is already done.
+    """
+    async with job_lease(name) as leader:
+        if not leader:
+            print(f"{name} {tick:%Y-%m-%d %H:%M}: running in another process, skipped")
+            return None
+
+        async with DB() as db:
+            run_id = await db.run_transaction(lambda cursor: _claim(cursor, name, tick))
+        if run_id is None:
+            print(f"{name} {tick:%Y-%m-%d %H:%M}: already done, skipped")
+            return None
+
+        try:
+            result = await job()
+        except Exception as e:
+            async with DB() as db:
+                await db.execute_query_insert(FINISH_RUN_QUERY, ("failed", str(e)[:4000], run_id))
+            raise
+        async with DB() as db:
+            await db.execute_query_insert(FINISH_RUN_QUERY, ("succeeded", orjson.dumps(result).decode(), run_id))
+        return result
@@ -0,0 +1,106 @@
+import os
+import time
+import asyncio
+from app.db import DB
+from app.catalog import catalog
+
+STATISTICS_TTL_SECONDS = float(os.getenv("STATISTICS_TTL_SECONDS", "30"))
+CARRERAS = ("ITC", "ITD", "IRS")
+
+# Active and cancelled reservations per space and Carrera over the last 30 days, read from the
+# pre-aggregated dbo.DailyReservationRollup so the cost does not grow with reservation history.
+# Zones, goals and percentages are derived from these rows in Python.
+RESERVATION_COUNTS_QUERY = '''
+    SELECT SpaceId, Carrera, SUM(Active) AS NoCanceladas, SUM(Cancelled) AS Canceladas
+    FROM [dbo].[DailyReservationRollup]
+    WHERE Day >= DATEADD(day, -30, GETDATE())
+    GROUP BY SpaceId, Carrera;
+'''
+
+_counts = None
+_counts_loaded_at = None
+_counts_lock = asyncio.Lock()
+
+
+async def reservation_counts():
+    """
+    Rows of (SpaceId, Carrera, NoCanceladas, Canceladas) for the last 30 days.
+
+    Cached for STATISTICS_TTL_SECONDS so a dashboard refresh that calls every statistics
+    endpoint only scans the reservations once.
+    """
+    global _counts, _counts_loaded_at
+    async with _counts_lock:
+        if _counts is None or time.monotonic() - _counts_loaded_at > STATISTICS_TTL_SECONDS:
+            async with DB(read_only=True) as db:
+                rows = await db.execute_query(RESERVATION_COUNTS_QUERY)
+            if rows is None:
+                raise Exception("Could not load reservation statistics")
+            _counts = [tuple(row) for row in rows]
+            _counts_loaded_at = time.monotonic()
+        return _counts
+
+
+def summarize(rows, space_ids, goal):
+    """
+    Totals, cancel ratio, goal progress and per-Carrera counts for the rows of `space_ids`.
+    """
+    no_canceladas = 0
+    canceladas = 0
+    carreras = {carrera: 0 for carrera in CARRERAS}
+    for space_id, carrera, active, cancelled in rows:
+        if space_id not in space_ids:
+            continue
+        no_canceladas += active
+        canceladas += cancelled
+        if carrera:
+            carreras[carrera] = carreras.get(carrera, 0) + active
+
+    total_reservas = no_canceladas + canceladas
+    return {
+        "NoCanceladas": no_canceladas,
+        "Canceladas": canceladas,
+        "NoCanceladasPorcentaje": round((no_canceladas / total_reservas * 100), 0) if total_reservas > 0 else 0,
+        "CanceladasPorcentaje": round((canceladas / total_reservas * 100), 0) if total_reservas > 0 else 0,
+        "Meta": goal,
+        "RestanteMeta": goal - no_canceladas,
+        "ActualMeta": no_canceladas,
+        "Carreras": carreras,
+    }
+
+
+def frequent_spaces(rows, space_ids):
+    """
+    Active reservations per space of `space_ids`, most reserved first.
+    """
+    totals = {}
+    for space_id, _, active, _ in rows:
+        if space_id in space_ids and active:
+            totals[space_id] = totals.get(space_id, 0) + active
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+async def zone_space_ids(zone_id=None):
+    if zone_id is None:
+        return {space.space_id for space in await catalog.spaces()}
+    return {space.space_id for space in await catalog.spaces_in_zone(zone_id)}
+
+
+async def zone_statistics():
+    """
+    Statistics for every zone plus a "General" entry covering all spaces, from a single scan.
+    """
+    rows = await reservation_counts()
+    zones = await catalog.zones()
+    results = [{
+        "ZoneId": None,
+        "Zone": "General",
+        **summarize(rows, await zone_space_ids(), sum(zone.goal for zone in zones)),
+    }]
+    for zone in zones:
+        results.append({
+            "ZoneId": zone.zone_id,
+            "Zone": zone.zone_name,
+            **summarize(rows, await zone_space_ids(zone.zone_id), zone.goal),
+        })
+    return results
@@ -0,0 +1,60 @@
+import os
+import datetime
+from app.db import DB
+
+TAG_INDEX_REFRESH_SECONDS = int(os.getenv("TAG_INDEX_REFRESH_SECONDS", "300"))
+
+TAGS_QUERY = "SELECT [TagId], [UserId] FROM [dbo].[User] WHERE [TagId] IS NOT NULL AND [TagId] <> '';"
+TAG_QUERY = "SELECT [UserId] FROM [dbo].[User] WHERE [TagId] = ?;"
+
+
+class TagIndex:
+    """
+    In-memory TagId -> UserId map so badge taps are answered without a database round trip.
+
+    The whole map is reloaded periodically, `/login/create` adds new tags as they are created,
+    and a tag that is not in the map is looked up in the database before it is rejected.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.loaded_at = None
+        self._users = {}
+
+    async def reload(self):
+        async with DB() as db:
+            rows = await db.execute_query(TAGS_QUERY)
+        if rows is None:
+            return None
+        self._users = {row[0]: row[1] for row in rows}
+        self.ready = True
+        self.loaded_at = datetime.datetime.now()
+        return len(self._users)
+
+    def add(self, tag_id, user_id):
+        if tag_id:
+            self._users[tag_id] = user_id
+
+    async def refresh_tag(self, tag_id):
+        """
+        Re-reads one tag from the database, updating or dropping its entry. Returns its UserId or None.
+        """
+        if not tag_id:
+            return None
+        async with DB() as db:
+            rows = await db.execute_query(TAG_QUERY, (tag_id,))
+        if not rows:
+            if rows is not None:
+                self._users.pop(tag_id, None)
+            return None
+        self._users[tag_id] = rows[0][0]
+        return rows[0][0]
+
+    async def user_id(self, tag_id):
+        user_id = self._users.get(tag_id)
+        if user_id is not None:
+            return user_id
+        return await self.refresh_tag(tag_id)
+
+
+tag_index = TagIndex()
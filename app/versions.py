@@ -0,0 +1,122 @@
+import os
+import time
+from uuid import uuid4
+from contextvars import ContextVar
+from fastapi import Response
+
+ETAG_MAX_STALENESS_SECONDS = int(os.getenv("ETAG_MAX_STALENESS_SECONDS", "30"))
+WRITE_PIN_COOKIE = "db_written_at"
+WRITE_PIN_HEADER = "X-DB-Written-At"
+
+# Per request: {"client": <last write the client reported, epoch seconds>, "wrote": <epoch of a write in this request>}
+_request_writes = ContextVar("request_writes", default=None)
+
+
+class VersionCounters:
+    """
+    Per-user and per-space counters bumped whenever their data changes, used to build ETags.
+
+    The counters live in this process only. Every ETag also carries a time bucket of
+    ETAG_MAX_STALENESS_SECONDS, so a change made by another worker is never hidden behind
+    a 304 for longer than that.
+
+    The time of the last user and global bump is kept too, so the DB layer can keep a user's
+    reads on the primary while the replica may not have their write yet. Those times are per
+    process, so a request that writes also hands the client a write pin (WRITE_PIN_COOKIE /
+    WRITE_PIN_HEADER, see `begin_request`/`end_request`) that sends its next reads to the
+    primary whichever worker serves them.
+    """
+
+    def __init__(self):
+        self._boot = uuid4().hex[:8]
+        self._global = 0
+        self._users = {}
+        self._spaces = {}
+        self._user_written_at = {}
+        self._all_written_at = None
+
+    def bump_user(self, user_id):
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        self._user_written_at[user_id] = time.monotonic()
+        self._note_request_write()
+
+    def bump_space(self, space_id):
+        self._spaces[space_id] = self._spaces.get(space_id, 0) + 1
+        self._note_request_write()
+
+    def bump_all(self):
+        self._global += 1
+        self._all_written_at = time.monotonic()
+        self._note_request_write()
+
+    def _note_request_write(self):
+        state = _request_writes.get()
+        if state is not None:
+            state["wrote"] = time.time()
+
+    def begin_request(self, request):
+        """
+        Reads the write pin the client sent back, if any, for the rest of this request.
+        """
+        pin = request.headers.get(WRITE_PIN_HEADER) or request.cookies.get(WRITE_PIN_COOKIE)
+        try:
+            client = float(pin) if pin else None
+        except ValueError:
+            client = None
+        _request_writes.set({"client": client, "wrote": None})
+
+    def end_request(self, response, seconds):
+        """
+        Hands the client a write pin valid for `seconds` when this request wrote anything.
+        """
+        state = _request_writes.get()
+        if state is None or state["wrote"] is None:
+            return
+        pin = f"{state['wrote']:.3f}"
+        response.headers[WRITE_PIN_HEADER] = pin
+        response.set_cookie(WRITE_PIN_COOKIE, pin, max_age=max(int(seconds), 1), httponly=True, samesite="lax")
+
+    def written_within(self, seconds, user_id=None):
+        """
+        Whether `user_id` (or everything, through bump_all) changed in the last `seconds`, or
+        the client of the current request wrote anything in that time on any worker.
+        """
+        state = _request_writes.get()
+        if state is not None and state["client"] is not None and time.time() - state["client"] < seconds:
+            return True
+        now = time.monotonic()
+        if self._all_written_at is not None and now - self._all_written_at < seconds:
+            return True
+        written_at = self._user_written_at.get(user_id) if user_id is not None else None
+        if written_at is None:
+            return False
+        if now - written_at < seconds:
+            return True
+        del self._user_written_at[user_id]
+        return False
+
+    def _etag(self, kind, key, counter):
+        bucket = int(time.time() // ETAG_MAX_STALENESS_SECONDS)
+        return f'W/"{self._boot}-{self._global}-{kind}{key}.{counter}-{bucket}"'
+
+    def user_etag(self, user_id):
+        return self._etag("u", user_id, self._users.get(user_id, 0))
+
+    def space_etag(self, space_id):
+        return self._etag("s", space_id, self._spaces.get(space_id, 0))
+
+
+versions = VersionCounters()
+
+
+def not_modified(request, response, etag):
+    """
+    Sets the ETag on `response` and returns a 304 response when the client already has it,
+    otherwise None. Compute `etag` before querying so a concurrent change is never missed.
+    """
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
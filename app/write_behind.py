@@ -0,0 +1,109 @@
+import os
+import asyncio
+from app.db import DB
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "10"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+
+PENDING_INSERT_QUERY = "INSERT INTO [dbo].[PendingReservation] (UserId, SpaceId, ScheduleId, UserRequirements) VALUES (?, ?, ?, ?);"
+
+
+class WriteBehindBatcher:
+    """
+    Collects the rows of one INSERT for up to `max_delay_ms` (or `max_batch` rows) and writes
+    them with a single executemany and commit.
+
+    `submit` only returns once the transaction holding its row has committed, so an
+    acknowledged row is never lost; if the process dies before a flush, its callers never got
+    an answer. When a batch fails its rows are retried one by one, so a single bad row only
+    fails its own caller.
+    """
+
+    def __init__(self, query, max_delay_ms=WRITE_BEHIND_MAX_DELAY_MS, max_batch=WRITE_BEHIND_MAX_BATCH):
+        self.query = query
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self._rows = []
+        self._timer = None
+        self._flushes = set()
+        self.batches = 0
+        self.rows = 0
+
+    async def submit(self, params):
+        future = asyncio.get_running_loop().create_future()
+        self._rows.append((tuple(params), future))
+        if len(self._rows) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        rows, self._rows = self._rows, []
+        if rows:
+            task = asyncio.ensure_future(self._flush(rows))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    def _write(self, cursor, params):
+        cursor.fast_executemany = True
+        cursor.executemany(self.query, params)
+        return len(params)
+
+    async def _flush(self, rows):
+        try:
+            async with DB() as db:
+                await db.run_transaction(lambda cursor: self._write(cursor, [params for params, _ in rows]))
+        except Exception as e:
+            print(f"Write-behind batch of {len(rows)} rows failed, retrying them one by one: {e}")
+            try:
+                await self._flush_one_by_one(rows)
+            except Exception as e:
+                for _, future in rows:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(rows)
+        for _, future in rows:
+            if not future.done():
+                future.set_result(1)
+
+    async def _flush_one_by_one(self, rows):
+        async with DB() as db:
+            for params, future in rows:
+                try:
+                    await db.run_transaction(lambda cursor: self._write(cursor, [params]))
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    self.rows += 1
+                    if not future.done():
+                        future.set_result(1)
+
+    def stats(self):
+        return {"queued": len(self._rows), "flushing": len(self._flushes), "batches": self.batches, "rows": self.rows}
+
+    async def close(self):
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+pending_writes = WriteBehindBatcher(PENDING_INSERT_QUERY)
+
+
+async def insert_pending_reservation(user_id, space_id, schedule_id, user_requirements):
+    """
+    Inserts a PendingReservation row, through the write-behind batcher when WRITE_BEHIND_ENABLED.
+    """
+    params = (user_id, space_id, schedule_id, user_requirements)
+    if WRITE_BEHIND_ENABLED:
+        return await pending_writes.submit(params)
+    async with DB() as db:
+        return await db.execute_query_insert(PENDING_INSERT_QUERY, params)
@@ -0,0 +1,335 @@
+"""
+In-process stand-in for Azure SQL, exposed through a pyodbc-like connect(connection_string).
+
+It does not parse SQL. Every statement is fingerprinted with the same normalizer as the slow-query
+log and routed to a handler registered for that statement shape; statements without a handler
+succeed with no rows. The data is synthetic and generated from a seed, so runs are repeatable.
+
+Use it with `pool.connection_factory = FakeDatabase(...).connect` or, for a real server,
+DB_CONNECTION_FACTORY=benchmarks.fake_db:connect.
+"""
+import os
+import re
+import time
+import random
+import datetime
+import threading
+import bcrypt
+from app.query_log import fingerprint
+
+CARRERAS = ("ITC", "ITD", "IRS", "")
+PASSWORD = "password"
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+class FakeDatabase:
+    def __init__(self, users=500, zones=4, spaces=24, days=7, open_hour=7, close_hour=22, pending=1000, occupied_ratio=0.3, latency_ms=None, seed=42):
+        self.latency = (latency_ms if latency_ms is not None else float(os.getenv("FAKE_DB_LATENCY_MS", "1"))) / 1000
+        self.lock = threading.Lock()
+        self.statements = 0
+        self.connections = 0
+        self.handlers = []
+        self.many_handlers = []
+        self.temp_tables = {}
+        rng = random.Random(seed)
+
+        password_hash = _hash_password(PASSWORD, int(os.getenv("BCRYPT_ROUNDS", "12")))
+        self.users = {}
+        for user_id in range(1, users + 1):
+            self.users[user_id] = (
+                user_id, f"user{user_id}", password_hash, f"User {user_id}", 1 if user_id % 50 else 2,
+                rng.randint(0, 3), None, f"TAG{user_id:06d}", rng.choice(CARRERAS),
+            )
+        self.users_by_name = {row[1]: row for row in self.users.values()}
+        self.users_by_tag = {row[7]: row for row in self.users.values()}
+
+        self.zones = [(zone_id, f"Zone {zone_id}", f"Synthetic zone {zone_id}", 100) for zone_id in range(1, zones + 1)]
+        self.spaces = []
+        self.requirements = {}
+        for space_id in range(1, spaces + 1):
+            zone_id = (space_id - 1) % zones + 1
+            self.spaces.append((space_id, f"Space {space_id}", f"Space {space_id} of zone {zone_id}", zone_id))
+            self.requirements[space_id] = [(space_id, requirement_id, f"Requirement {requirement_id}", 4) for requirement_id in (1, 2)]
+
+        self.schedules = {}
+        self.slot_keys = set()
+        today = datetime.date.today()
+        for offset in range(days):
+            day = today + datetime.timedelta(days=offset)
+            for space_id, *_ in self.spaces:
+                for hour in range(open_hour, close_hour):
+                    self.add_schedule(space_id, day, datetime.time(hour), datetime.time(hour + 1), rng.random() < occupied_ratio)
+
+        self.pending = {}
+        self.reservations = []
+        free = [schedule for schedule in self.schedules.values() if not schedule[5]]
+        for _ in range(pending):
+            schedule = rng.choice(free)
+            self.add_pending(rng.randint(1, users), schedule[0], schedule[1], "1,2", datetime.datetime.now() - datetime.timedelta(seconds=rng.randint(0, 86400)))
+        for schedule in self.schedules.values():
+            if schedule[5]:
+                self.reservations.append((len(self.reservations) + 1, rng.randint(1, users), schedule[0], schedule[1], len(self.reservations) + 1))
+
+        self.register(r"^select \?$", lambda params: [(1,)])
+        self.register(r"^exec searchuser ", self._search_user)
+        self.register(r"^select patternpassword, userid", self._pattern_user)
+        self.register(r"^select \[userid\] from \[dbo\]\.\[user\] where username = \?", self._user_id_by_name)
+        self.register(r"^select \[tagid\], \[userid\] from \[dbo\]\.\[user\]", lambda params: [(row[7], row[0]) for row in self.users.values()])
+        self.register(r"^select \[userid\] from \[dbo\]\.\[user\] where \[tagid\] = \?", self._user_id_by_tag)
+        self.register(r"^select \[zoneid\], \[zonename\], \[description\], \[goal\] from \[dbo\]\.\[zone\]", lambda params: list(self.zones))
+        self.register(r"^select \[spaceid\], \[name\], \[description\], \[zoneid\] from \[dbo\]\.\[space\]", lambda params: list(self.spaces))
+        self.register(r"^exec getspacerequirements ", lambda params: list(self.requirements.get(int(params[0]), [])))
+        self.register(r"^select \[scheduleid\], \[spaceid\], \[day\], \[starthour\], \[endhour\], \[occupied\] from \[dbo\]\.\[schedule\] where \[day\] >=", self._upcoming_schedules)
+        self.register(r"^exec getschedule ", self._free_schedules)
+        self.register(r"^insert into \[dbo\]\.\[pendingreservation\]", self._insert_pending)
+        self.register(r"^insert into \[dbo\]\.\[pendingreservation\]", self._insert_pending_many, many=True)
+        self.register(r"^exec getreservationdetails ", self._reservation_details)
+        self.register(r"^exec getpendingreservations ", self._pending_reservations)
+        self.register(r"from \[dbo\]\.\[dailyreservationrollup\]", self._rollup)
+        self.register(r"from \[dbo\]\.\[statistic\] where userid = \?", lambda params: [(len(self.reservations) // len(self.users), 10, 3)])
+        self.register(r"^select top \(\?\) \[user\]\.\[name\]", self._admin_reservations)
+
+        # Batch jobs (app/functions.py). Temp tables live on the database rather than the connection,
+        # which is fine as long as one job runs at a time.
+        self.register(r"^select spaceid, weekday, openhour, closehour from \[dbo\]\.\[spacehours\]", lambda params: [])
+        self.register(r"^select spaceid from \[dbo\]\.\[space\]", lambda params: [(row[0],) for row in self.spaces])
+        self.register(r"^delete sc from \[dbo\]\.\[schedule\] sc where sc\.day < \? and sc\.occupied = \?", self._delete_past_schedules)
+        self.register(r"^insert into #(\w+) ", self._fill_temp_table, many=True)
+        self.register(r"^set nocount on; insert into \[dbo\]\.\[schedule\]", self._insert_slots)
+        self.register(r"^select pr\.pendingreservationid, u\.userid", self._pending_for_allocation)
+        self.register(r"^set nocount on; delete w from #winners", self._write_allocation)
+
+    def register(self, pattern, handler, many=False):
+        """
+        Routes statements whose lower-cased fingerprint matches `pattern` to `handler(params, *groups)`,
+        which returns the result rows, a (rows, rowcount) tuple, or (rows, rowcount, [more result sets])
+        for batches read with nextset(). `many` handlers receive the executemany parameter list.
+        Later registrations win.
+        """
+        (self.many_handlers if many else self.handlers).insert(0, (re.compile(pattern), handler))
+
+    def connect(self, connection_string=None):
+        with self.lock:
+            self.connections += 1
+        return FakeConnection(self)
+
+    def add_schedule(self, space_id, day, start_hour, end_hour, occupied=False):
+        schedule_id = len(self.schedules) + 1
+        self.schedules[schedule_id] = [schedule_id, space_id, day, start_hour, end_hour, occupied]
+        self.slot_keys.add((space_id, day, start_hour))
+        return schedule_id
+
+    def add_pending(self, user_id, schedule_id, space_id, requirements, created=None):
+        pending_id = len(self.pending) + 1
+        self.pending[pending_id] = [pending_id, user_id, schedule_id, requirements, space_id, created or datetime.datetime.now(), False]
+        return pending_id
+
+    def run(self, query, params, many=False):
+        key = fingerprint(query).lower()
+        with self.lock:
+            self.statements += 1
+        if self.latency:
+            time.sleep(self.latency)
+        for pattern, handler in (self.many_handlers if many else self.handlers):
+            match = pattern.search(key)
+            if match:
+                with self.lock:
+                    result = handler(params, *match.groups())
+                if not isinstance(result, tuple):
+                    return result, len(result), []
+                return result if len(result) == 3 else (*result, [])
+        rowcount = (len(params) if many else 1) if re.match(r"^(insert|update|delete|merge)", key) else -1
+        return [], rowcount, []
+
+    def _delete_past_schedules(self, params):
+        today = params[0]
+        referenced = {pending[2] for pending in self.pending.values()} | {reservation[2] for reservation in self.reservations}
+        past = [schedule_id for schedule_id, schedule in self.schedules.items() if schedule[2] < today and not schedule[5] and schedule_id not in referenced]
+        for schedule_id in past:
+            schedule = self.schedules.pop(schedule_id)
+            self.slot_keys.discard((schedule[1], schedule[2], schedule[3]))
+        return [], len(past)
+
+    def _fill_temp_table(self, params, table):
+        self.temp_tables[table] = params
+        return [], len(params)
+
+    def _insert_slots(self, params):
+        inserted = 0
+        for space_id, day, start_hour, end_hour in self.temp_tables.pop("slots", []):
+            if (space_id, day, start_hour) not in self.slot_keys:
+                self.add_schedule(space_id, day, start_hour, end_hour)
+                inserted += 1
+        return [(inserted,)]
+
+    def _pending_for_allocation(self, params):
+        rows = []
+        for pending_id, user_id, schedule_id, requirements, space_id, created, processed in self.pending.values():
+            if not processed:
+                rows.append((pending_id, user_id, schedule_id, requirements, space_id, created, self.users[user_id][5], self.schedules[schedule_id][5] if schedule_id in self.schedules else True))
+        rows.sort(key=lambda row: row[5])
+        return rows
+
+    def _write_allocation(self, params):
+        confirmed = []
+        for pending_id, user_id, space_id, schedule_id, requirements, group_code in self.temp_tables.pop("winners", []):
+            schedule = self.schedules[schedule_id]
+            if schedule[5]:
+                continue
+            schedule[5] = True
+            group_id = len(self.reservations) + 1
+            self.reservations.append((group_id, user_id, schedule_id, space_id, group_id))
+            confirmed.append((schedule_id, user_id, space_id))
+        for (pending_id,) in self.temp_tables.pop("loaded", []):
+            self.pending[pending_id][6] = True
+        return confirmed, -1
+
+    def _search_user(self, params):
+        row = self.users_by_name.get(params[0])
+        return [row[:7]] if row else []
+
+    def _pattern_user(self, params):
+        row = self.users_by_name.get(params[0])
+        return [(None, row[0], row[3], row[4], row[5], row[6])] if row else []
+
+    def _user_id_by_name(self, params):
+        row = self.users_by_name.get(params[0])
+        return [(row[0],)] if row else []
+
+    def _user_id_by_tag(self, params):
+        row = self.users_by_tag.get(params[0])
+        return [(row[0],)] if row else []
+
+    def _upcoming_schedules(self, params):
+        today = datetime.date.today()
+        return [tuple(schedule) for schedule in self.schedules.values() if schedule[2] >= today]
+
+    def _free_schedules(self, params):
+        space_id = int(params[0])
+        return [(s[0], s[2], s[3], s[4]) for s in self.schedules.values() if s[1] == space_id and not s[5]]
+
+    def _insert_pending(self, params):
+        user_id, space_id, schedule_id, requirements = params[:4]
+        self.add_pending(user_id, schedule_id, space_id, requirements)
+        return [], 1
+
+    def _insert_pending_many(self, seq_of_params):
+        for params in seq_of_params:
+            self._insert_pending(params)
+        return [], len(seq_of_params)
+
+    def _reservation_details(self, params):
+        user_id = int(params[0])
+        rows = []
+        for _, owner, schedule_id, space_id, group_id in self.reservations:
+            if owner == user_id:
+                schedule = self.schedules[schedule_id]
+                rows.append((schedule[2], schedule[3], schedule[4], f"Space {space_id}", space_id, "1,2", f"G{group_id:08d}"))
+        return rows
+
+    def _pending_reservations(self, params):
+        user_id = int(params[0])
+        rows = []
+        for pending_id, owner, schedule_id, _, space_id, _, processed in self.pending.values():
+            if owner == user_id and not processed:
+                schedule = self.schedules[schedule_id]
+                rows.append((pending_id, space_id, schedule[2], schedule[3], schedule[4]))
+        return rows
+
+    def _rollup(self, params):
+        totals = {}
+        for _, user_id, _, space_id, _ in self.reservations:
+            key = (space_id, self.users[user_id][8])
+            totals[key] = totals.get(key, 0) + 1
+        return [(space_id, carrera, active, active // 10) for (space_id, carrera), active in totals.items()]
+
+    def _admin_reservations(self, params):
+        limit = int(params[0])
+        rows = []
+        for reservation_id, user_id, schedule_id, space_id, group_id in self.reservations[:limit]:
+            user, schedule = self.users[user_id], self.schedules[schedule_id]
+            rows.append((user[3], user[1], schedule[2], schedule[3], schedule[4], f"Space {space_id}", space_id, user_id, f"G{group_id:08d}", schedule_id, group_id))
+        rows.sort(key=lambda row: (row[2], row[9], row[10]))
+        return rows
+
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.fast_executemany = False
+        self.rowcount = -1
+        self._results = []
+        self._rows = []
+
+    def _params(self, args):
+        if len(args) == 1 and isinstance(args[0], (tuple, list)):
+            return tuple(args[0])
+        return args
+
+    def execute(self, query, *args):
+        rows, self.rowcount, more = self.database.run(query, self._params(args))
+        self._rows = list(rows)
+        self._results = [list(result) for result in more]
+        return self
+
+    def executemany(self, query, seq_of_params):
+        seq_of_params = [tuple(params) for params in seq_of_params]
+        rows, self.rowcount, more = self.database.run(query, seq_of_params, many=True)
+        self._rows = list(rows)
+        self._results = [list(result) for result in more]
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def nextset(self):
+        if self._results:
+            self._rows = self._results.pop(0)
+            return True
+        self._rows = []
+        return False
+
+    def close(self):
+        self._rows = []
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self.database)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+_databases = {}
+
+
+def connect(connection_string=None):
+    """
+    pyodbc.connect replacement for DB_CONNECTION_FACTORY. Every distinct connection string gets
+    its own FakeDatabase, so AZURE_SQL_CONNECTIONSTRING and AZURE_SQL_READ_CONNECTIONSTRING can
+    stand in for a primary and a replica that drift apart.
+    """
+    if connection_string not in _databases:
+        _databases[connection_string] = FakeDatabase()
+    return _databases[connection_string].connect(connection_string)
@@ -0,0 +1,120 @@
+"""
+Microbenchmarks of the batch jobs, assign_spaces and create_new_schedules, against the fake
+database at several dataset sizes.
+
+    python -m benchmarks.jobs --pending 100,1000,10000,100000 --spaces 15,50,150,500 --output benchmarks/jobs.jsonl
+
+Every run gets a freshly seeded dataset and is measured twice: once for wall time and statement
+count, and once under tracemalloc for peak memory (kept apart because tracing slows Python down).
+Results are printed as JSON and, with --output, appended as one JSON line per run so the file
+keeps the history across commits. Peak memory includes the rows the fake database hands back,
+which stands in for the driver's result buffers.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import platform
+import subprocess
+import tracemalloc
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def measure(make_database, job, trace_memory):
+    from app.db import pool
+
+    database = make_database()
+    await pool.close()
+    pool.connection_factory = database.connect
+    statements = database.statements
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        summary = await job()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return {
+        "wall_seconds": round(elapsed, 4),
+        "queries": database.statements - statements,
+        "peak_memory_bytes": peak,
+        "summary": summary,
+    }
+
+
+async def run(make_database, job, name, sizes):
+    timed = await measure(make_database, job, trace_memory=False)
+    traced = await measure(make_database, job, trace_memory=True)
+    return {
+        "job": name,
+        **sizes,
+        "wall_seconds": timed["wall_seconds"],
+        "queries": timed["queries"],
+        "peak_memory_bytes": traced["peak_memory_bytes"],
+        "summary": timed["summary"],
+    }
+
+
+async def main(args):
+    # No logins happen here, keep the synthetic password hashes cheap to build
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    from benchmarks.fake_db import FakeDatabase
+    from app.db import pool, executor
+    from app.functions import assign_spaces, create_new_schedules
+
+    pending_sizes = [int(size) for size in args.pending.split(",")]
+    space_sizes = [int(size) for size in args.spaces.split(",")]
+    context = {
+        "at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "latency_ms": args.latency_ms,
+    }
+
+    results = []
+    try:
+        for spaces in space_sizes:
+            def make_database(pending=0):
+                return FakeDatabase(users=args.users, spaces=spaces, days=args.days, pending=pending, latency_ms=args.latency_ms)
+
+            runs = [(make_database, lambda: create_new_schedules(args.horizon_days), "create_new_schedules", {"spaces": spaces, "horizon_days": args.horizon_days})]
+            for pending in pending_sizes:
+                runs.append((lambda pending=pending: make_database(pending), assign_spaces, "assign_spaces", {"spaces": spaces, "pending": pending}))
+            for run_args in runs:
+                results.append(await run(*run_args))
+                print(json.dumps(results[-1]), file=sys.stderr)
+    finally:
+        await pool.close()
+        executor.shutdown()
+
+    results = [{**context, **result} for result in results]
+    if args.output:
+        with open(args.output, "a") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark assign_spaces and create_new_schedules against the fake database.")
+    parser.add_argument("--pending", default="100,1000,10000,100000", help="Comma separated pending reservation counts")
+    parser.add_argument("--spaces", default="15,50,150,500", help="Comma separated space counts")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=7, help="Days of existing schedule in the dataset")
+    parser.add_argument("--horizon-days", type=int, default=14, help="Horizon passed to create_new_schedules")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated latency per statement")
+    parser.add_argument("--output", help="JSON Lines file to append the results to")
+    asyncio.run(main(parser.parse_args()))
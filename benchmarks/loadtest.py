@@ -0,0 +1,208 @@
+"""
+Load test of the API against the in-process fake database (benchmarks/fake_db.py).
+
+The app runs in this process behind httpx's ASGI transport, so no server, network or Azure SQL
+is involved; what is measured is the app itself plus the simulated per-statement latency.
+
+    python -m benchmarks.loadtest --scenario all --concurrency 50 --requests 2000 --output results.json
+    python -m benchmarks.loadtest --baseline results.json --max-regression 0.2
+
+Prints (and optionally writes) a JSON report with throughput and p50/p95/p99 latency per scenario
+and endpoint. With --baseline it exits with status 1 when any endpoint's p95 regressed by more
+than --max-regression.
+"""
+import os
+import sys
+import math
+import time
+import json
+import random
+import asyncio
+import argparse
+import datetime
+
+API_KEY = "loadtest"
+DAYS_ES = ['lunes', 'martes', 'miércoles', 'jueves', 'viernes', 'sábado', 'domingo']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def login_storm(rng, db):
+    user = rng.choice(list(db.users.values()))
+    if rng.random() < 0.8:
+        return "POST", "/login/", {"username": user[1], "password": "password"}, "POST /login/"
+    return "POST", "/login/id/iot", {"TagId": user[7]}, "POST /login/id/iot"
+
+
+def reservation_burst(rng, db):
+    user_id = rng.randint(1, len(db.users))
+    choice = rng.random()
+    if choice < 0.5:
+        schedule = rng.choice(list(db.schedules.values()))
+        return "POST", "/reservations/create", {"user_id": user_id, "schedule_id": schedule[0], "space_id": schedule[1], "user_requirements": "1,2"}, "POST /reservations/create"
+    if choice < 0.75:
+        return "GET", f"/reservations/{user_id}", None, "GET /reservations/{user_id}"
+    return "GET", f"/reservations/pending/{user_id}", None, "GET /reservations/pending/{user_id}"
+
+
+def chatbot_browse(rng, db):
+    space_id = rng.choice(db.spaces)[0]
+    choice = rng.random()
+    if choice < 0.15:
+        return "GET", "/chatbot/zones", None, "GET /chatbot/zones"
+    if choice < 0.3:
+        return "GET", f"/chatbot/spaces/zone/{rng.choice(db.zones)[1]}", None, "GET /chatbot/spaces/zone/{zone_name}"
+    if choice < 0.6:
+        return "GET", f"/chatbot/schedules/{space_id}/{rng.choice(DAYS_ES)}", None, "GET /chatbot/schedules/{SpaceId}/{Day}"
+    if choice < 0.75:
+        return "GET", f"/chatbot/requirements/{space_id}", None, "GET /chatbot/requirements/{SpaceId}"
+    return "GET", f"/reservations/schedule/{space_id}", None, "GET /reservations/schedule/{area_id}"
+
+
+def admin_dashboard(rng, db):
+    return rng.choice([
+        ("GET", "/admin/estadisticas", None, "GET /admin/estadisticas"),
+        ("GET", "/admin/estadisticasgeneral", None, "GET /admin/estadisticasgeneral"),
+        ("GET", "/admin/areasfrecuentesgeneral", None, "GET /admin/areasfrecuentesgeneral"),
+        ("GET", "/admin/reservations?limit=100", None, "GET /admin/reservations"),
+        ("GET", "/admin/available-spaces", None, "GET /admin/available-spaces"),
+        ("GET", f"/user/statistics/{rng.randint(1, len(db.users))}", None, "GET /user/statistics/{UserId}"),
+    ])
+
+
+SCENARIOS = {
+    "login_storm": login_storm,
+    "reservation_burst": reservation_burst,
+    "chatbot_browse": chatbot_browse,
+    "admin_dashboard": admin_dashboard,
+}
+
+
+async def run_scenario(client, db, scenario, requests, concurrency, seed):
+    rng = random.Random(seed)
+    plan = [scenario(rng, db) for _ in range(requests)]
+    latencies = {}
+    statuses = {}
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while position < len(plan):
+            method, url, body, label = plan[position]
+            position += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                status = response.status_code
+            except Exception as e:
+                print(f"{label}: {e}", file=sys.stderr)
+                status = "exception"
+            latencies.setdefault(label, []).append(time.perf_counter() - started)
+            statuses.setdefault(label, {}).setdefault(str(status), 0)
+            statuses[label][str(status)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        endpoints[label] = {
+            "requests": len(values),
+            "statuses": statuses[label],
+            "throughput_rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        }
+    return {
+        "requests": len(plan),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(plan) / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+def compare(report, baseline, max_regression):
+    regressions = []
+    for name, scenario in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name, {}).get("endpoints", {})
+        for label, current in scenario["endpoints"].items():
+            before = previous.get(label)
+            if before and before["p95_ms"] and current["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                regressions.append({"scenario": name, "endpoint": label, "baseline_p95_ms": before["p95_ms"], "p95_ms": current["p95_ms"]})
+    return regressions
+
+
+async def main(args):
+    os.environ.setdefault("API_KEY", API_KEY)
+    os.environ.setdefault("JWT_SECRET", "loadtest")
+    if args.bcrypt_rounds:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    # Imported after the environment is set up, the app reads its settings at import time
+    import httpx
+    from benchmarks.fake_db import FakeDatabase
+    from app.main import app
+    from app.db import pool, executor
+    from app.passwords import passwords
+    from app.availability import refresh_availability
+    from app.tags import tag_index
+
+    db = FakeDatabase(users=args.users, latency_ms=args.latency_ms, seed=args.seed)
+    pool.connection_factory = db.connect
+    await pool.warm_up()
+    await refresh_availability()
+    await tag_index.reload()
+
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    report = {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "settings": {"users": args.users, "latency_ms": db.latency * 1000, "concurrency": args.concurrency, "requests": args.requests, "seed": args.seed},
+        "scenarios": {},
+    }
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", headers={"x-api-key": os.environ["API_KEY"]}, timeout=None) as client:
+            for name in names:
+                report["scenarios"][name] = await run_scenario(client, db, SCENARIOS[name], args.requests, args.concurrency, args.seed)
+    finally:
+        await pool.close()
+        executor.shutdown()
+        passwords.shutdown()
+    report["database"] = {"statements": db.statements, "connections": db.connections}
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.max_regression)
+        status = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API against an in-process fake database.")
+    parser.add_argument("--scenario", default="all", help=f"Comma separated scenarios or 'all': {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=None, help="Simulated latency per statement (FAKE_DB_LATENCY_MS, default 1)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline", help="Previous report to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed p95 increase over the baseline, 0.2 = 20%%")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,38 @@
+-- Opening-hour templates used by create_new_schedules.
+-- Weekday follows Python's date.weekday(): 0 = Monday ... 6 = Sunday.
+-- A space with no rows for a weekday gets no slots that day.
+IF OBJECT_ID('dbo.SpaceHours', 'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[SpaceHours] (
+        SpaceId INT NOT NULL REFERENCES [dbo].[Space] (SpaceId),
+        Weekday TINYINT NOT NULL CHECK (Weekday BETWEEN 0 AND 6),
+        OpenHour TIME(0) NOT NULL,
+        CloseHour TIME(0) NOT NULL,
+        CONSTRAINT PK_SpaceHours PRIMARY KEY (SpaceId, Weekday)
+    );
+
+    -- Seed with the hours that used to be hard-coded: every space, Monday to Friday, 09:00 - 20:00.
+    INSERT INTO [dbo].[SpaceHours] (SpaceId, Weekday, OpenHour, CloseHour)
+    SELECT sp.SpaceId, d.Weekday, '09:00', '20:00'
+    FROM [dbo].[Space] sp
+    CROSS JOIN (VALUES (0), (1), (2), (3), (4)) AS d (Weekday);
+END;
+
+-- One slot per space, day and start hour. Free, unreferenced duplicates left by earlier
+-- double runs are removed first; if referenced duplicates remain the index creation fails
+-- and they have to be merged by hand.
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_Schedule_Space_Day_Start')
+BEGIN
+    WITH Ranked AS (
+        SELECT ScheduleId, Occupied,
+            ROW_NUMBER() OVER (PARTITION BY SpaceId, Day, StartHour ORDER BY Occupied DESC, ScheduleId) AS RowNumber
+        FROM [dbo].[Schedule]
+    )
+    DELETE sc FROM [dbo].[Schedule] sc
+    JOIN Ranked r ON r.ScheduleId = sc.ScheduleId
+    WHERE r.RowNumber > 1 AND r.Occupied = 0
+        AND NOT EXISTS (SELECT 1 FROM [dbo].[PendingReservation] pr WHERE pr.ScheduleId = sc.ScheduleId)
+        AND NOT EXISTS (SELECT 1 FROM [dbo].[Reservation] re WHERE re.ScheduleId = sc.ScheduleId);
+
+    CREATE UNIQUE INDEX UX_Schedule_Space_Day_Start ON [dbo].[Schedule] (SpaceId, Day, StartHour);
+END;
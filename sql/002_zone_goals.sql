@@ -0,0 +1,16 @@
+-- Monthly reservation goal per zone, used by the admin statistics endpoints.
+-- The general goal is the sum of all zone goals.
+IF COL_LENGTH('dbo.Zone', 'Goal') IS NULL
+BEGIN
+    ALTER TABLE [dbo].[Zone] ADD Goal INT NOT NULL CONSTRAINT DF_Zone_Goal DEFAULT 0;
+END;
+GO
+
+-- Goals that used to be hard-coded in app/routers/admin.py, keyed by zone name the same way the
+-- legacy dashboard routes find their zone (app/routers/admin.py zone_slug: case, accents and
+-- spaces ignored). Only zones still at the default are seeded, so goals set since are kept.
+UPDATE z SET Goal = v.Goal
+FROM [dbo].[Zone] z
+JOIN (VALUES ('espaciosabiertos', 40), ('garagevalley', 30), ('exploracion', 30)) AS v (Slug, Goal)
+    ON REPLACE(z.ZoneName, ' ', '') COLLATE Latin1_General_CI_AI = v.Slug COLLATE Latin1_General_CI_AI
+WHERE z.Goal = 0;
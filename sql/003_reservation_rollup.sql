@@ -0,0 +1,33 @@
+-- Pre-aggregated reservation counts for the admin dashboards, maintained incrementally by
+-- assign_spaces / instant_book (Active + 1) and reservation deletes
+-- (Active - 1, Cancelled + 1). Backfilled below on first deploy; rebuild with `python -m app.rollup`
+-- or POST /admin/rollup/rebuild.
+IF OBJECT_ID('dbo.DailyReservationRollup', 'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[DailyReservationRollup] (
+        Day DATE NOT NULL,
+        SpaceId INT NOT NULL,
+        Carrera NVARCHAR(50) NOT NULL,
+        Active INT NOT NULL DEFAULT 0,
+        Cancelled INT NOT NULL DEFAULT 0,
+        CONSTRAINT PK_DailyReservationRollup PRIMARY KEY (Day, SpaceId, Carrera)
+    );
+END;
+GO
+
+-- Backfill from the existing reservations (same aggregation as REBUILD_QUERY in app/rollup.py)
+-- so the dashboards are correct right after deploy. Skipped once the table has rows.
+IF NOT EXISTS (SELECT 1 FROM [dbo].[DailyReservationRollup])
+BEGIN
+    INSERT INTO [dbo].[DailyReservationRollup] (Day, SpaceId, Carrera, Active, Cancelled)
+    SELECT
+        s.Day,
+        r.SpaceId,
+        ISNULL(u.Carrera, ''),
+        SUM(CASE WHEN r.Deleted = 0 THEN 1 ELSE 0 END),
+        SUM(CASE WHEN r.Deleted = 1 THEN 1 ELSE 0 END)
+    FROM [dbo].[Reservation] r
+    JOIN [dbo].[Schedule] s ON r.ScheduleId = s.ScheduleId
+    JOIN [dbo].[User] u ON r.UserId = u.UserId
+    GROUP BY s.Day, r.SpaceId, ISNULL(u.Carrera, '');
+END;
@@ -0,0 +1,17 @@
+-- One row per (scheduled job, tick), written by app/scheduler.py. The unique key makes a tick
+-- run at most once across workers; Status 'failed' ticks are retried by the next run.
+IF OBJECT_ID('dbo.JobRun', 'U') IS NULL
+BEGIN
+    CREATE TABLE [dbo].[JobRun] (
+        JobRunId INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+        JobName NVARCHAR(100) NOT NULL,
+        Tick DATETIME2(0) NOT NULL,
+        Status NVARCHAR(20) NOT NULL,
+        Attempts INT NOT NULL DEFAULT 0,
+        StartedAt DATETIME2 NULL,
+        FinishedAt DATETIME2 NULL,
+        Host NVARCHAR(200) NULL,
+        Summary NVARCHAR(MAX) NULL,
+        CONSTRAINT UQ_JobRun_JobName_Tick UNIQUE (JobName, Tick)
+    );
+END;